@@ -0,0 +1,416 @@
+"""Offline load benchmark for /get-events, /get-itinerary and /get-coordinates.
+
+SerpAPI (Google Events) and Nominatim are replaced by local HTTP servers
+replaying fixtures, and Gemini by a stub in the model registry, each with its
+own latency and error rate, so no request leaves the machine and no quota is
+spent. The app is served over HTTP in-process from a scratch directory and
+driven by concurrent virtual users, each with its own session. Reports
+p50/p95/p99 latency and throughput per route plus the mean time per pipeline
+stage from /metrics; --max-p95-ms makes it usable as a regression gate.
+Usage: python bench_load.py [--users 8] [--iterations 5] [--max-p95-ms 2000]
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+ITINERARY_FIXTURE = os.path.join(BACKEND, "..", "..", "json_output", "final_itenary.json")
+PAGE_SIZE = 10
+CITIES = {
+    "Durham, NC": (35.994, -78.899),
+    "Raleigh, NC": (35.780, -78.639),
+    "Chapel Hill, NC": (35.913, -79.056),
+    "Cary, NC": (35.792, -78.781),
+    "Charlotte, NC": (35.227, -80.843),
+    "Asheville, NC": (35.595, -82.551),
+}
+KINDS = [
+    "Jazz Night", "Farmers Market", "Comedy Show", "Art Walk", "Trivia Night", "Yoga in the Park",
+    "Food Truck Rodeo", "Symphony Concert", "Craft Beer Tasting", "Book Reading", "Tech Meetup",
+]
+VENUES = ["Main Street Hall", "Riverside Park", "The Pinhook", "Central Library", "Union Brewery", "Arts Center"]
+SERPAPI_FIELDS = {
+    "title", "date", "address", "link", "description", "ticket_info", "venue",
+    "thumbnail", "image", "event_location_map",
+}
+ROUTES = ["/get-events", "/get-itinerary", "/get-coordinates"]
+
+
+class Fault:
+    """Latency (with +/-25% jitter) and error rate of one stand-in service."""
+
+    def __init__(self, latency_ms, error_rate, seed=0):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        """Sleeps for one call's latency; returns True if the call should fail."""
+        with self._lock:
+            delay = self.latency * self._random.uniform(0.75, 1.25)
+            failed = self._random.random() < self.error_rate
+        time.sleep(delay)
+        return failed
+
+
+def city_center(text):
+    for name, center in CITIES.items():
+        if name.split(",")[0].lower() in text.lower():
+            return center
+    return CITIES["Durham, NC"]
+
+
+def synthetic_events(location, count):
+    """Google Events results for `location` in SerpAPI's shape, dated over the coming week."""
+    rng = random.Random(zlib.crc32(location.lower().encode()))
+    today = date.today()
+    events = []
+    for i in range(count):
+        day = today + timedelta(days=rng.randrange(7))
+        start = rng.randrange(1, 8)
+        venue = rng.choice(VENUES)
+        events.append({
+            "title": f"{rng.choice(KINDS)} #{i}",
+            "date": {"start_date": f"{day:%b} {day.day}", "when": f"{day:%a}, {day:%b} {day.day}, {start} – {start + 2} PM"},
+            "address": [f"{100 + i} {venue}", location],
+            "link": f"https://example.com/events/{zlib.crc32(location.encode())}/{i}",
+            "description": f"A {rng.choice(['free', 'ticketed', 'family-friendly'])} event at {venue}.",
+            "ticket_info": [{"source": "Example Tickets", "link": f"https://example.com/tickets/{i}", "link_type": "tickets"}],
+            "venue": {"name": venue, "rating": round(rng.uniform(3.5, 5.0), 1), "reviews": rng.randrange(5, 2000)},
+        })
+    return events
+
+
+def load_events_fixture(path):
+    """Recorded events_results to replay, stripped of the fields the app adds after a search."""
+    with open(path, "r", encoding="utf-8") as file:
+        events = json.load(file)
+    return [{k: v for k, v in event.items() if k in SERPAPI_FIELDS} for event in events]
+
+
+def load_itinerary_fixture(path):
+    """A saved itinerary as the Gemini stub's reply, with fields older files lack filled in."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            itinerary = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        itinerary = {"type": "FeatureCollection", "features": []}
+    for feature in itinerary.get("features", []):
+        properties = feature.setdefault("properties", {})
+        properties.setdefault("address", properties.get("name", ""))
+        for key in ("name", "description", "time_since_start", "transport"):
+            properties.setdefault(key, "")
+        properties.setdefault("cost", 0)
+    itinerary.setdefault("total_estimated_cost", sum(f["properties"]["cost"] for f in itinerary.get("features", [])))
+    itinerary.setdefault("total_estimated_time", 0)
+    return itinerary
+
+
+class StubServer(ThreadingHTTPServer):
+    """Local HTTP service answering GET requests with `answer(params)` after its fault is applied."""
+
+    daemon_threads = True
+
+    def __init__(self, answer, fault):
+        self.answer = answer
+        self.fault = fault
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        if self.server.fault.apply():
+            status, body = 503, {"error": "Stub service unavailable"}
+        else:
+            status, body = 200, self.server.answer(params)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serpapi_answer(events_for):
+    """Google Events pages for the location named in the query."""
+
+    def answer(params):
+        match = re.match(r"Events in (.*) between", params.get("q", ""))
+        events = events_for(match.group(1) if match else "Durham, NC")
+        start = int(params.get("start", 0))
+        page = events[start:start + PAGE_SIZE]
+        if not page:
+            return {"error": "Google hasn't returned any results for this query."}
+        return {"search_metadata": {"status": "Success"}, "events_results": page}
+
+    return answer
+
+
+def nominatim_answer(params):
+    """A stable point near the city named in the address, or near Durham."""
+    query = params.get("q", "")
+    lat, lon = city_center(query)
+    h = zlib.crc32(query.lower().encode())
+    return [{
+        "place_id": h,
+        "lat": str(lat + (h % 1000 - 500) / 20000),
+        "lon": str(lon + (h // 1000 % 1000 - 500) / 20000),
+        "display_name": query,
+    }]
+
+
+class StubStream:
+    def __init__(self, text, usage):
+        self._chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        return iter(SimpleNamespace(text=chunk) for chunk in self._chunks)
+
+
+class GeminiStub:
+    """Stands in for a GenerativeModel, answering from fixtures picked by the requested schema."""
+
+    def __init__(self, name, fault, itinerary):
+        self.model_name = f"models/{name}"
+        self.fault = fault
+        self.itinerary = itinerary
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        if self.fault.apply():
+            raise RuntimeError("503 Gemini stub unavailable")
+        text = json.dumps(self.reply(prompt, (generation_config or {}).get("response_schema")))
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        if stream:
+            return StubStream(text, usage)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def reply(self, prompt, schema):
+        import llm
+        from categories import CATEGORIES
+
+        if schema is llm.CATEGORIZED_EVENTS_SCHEMA:
+            ids = re.findall(r'"id":\s*"([^"]+)"', prompt)
+            return [{"id": i, "category": CATEGORIES[zlib.crc32(i.encode()) % len(CATEGORIES)]} for i in ids]
+        if schema is llm.NARRATION_SCHEMA:
+            return {"descriptions": [], "restaurants": []}
+        if schema is llm.PREFERENCES_SCHEMA:
+            return {"themes": [{"theme": "Live music", "weight": 0.8, "keywords": ["jazz", "concert"]}]}
+        return self.itinerary
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class LoadDriver:
+    """Virtual users running get-events -> get-itinerary -> get-coordinates against the app."""
+
+    def __init__(self, base_url, args):
+        self.base_url = base_url
+        self.args = args
+        self.samples = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self._lock = threading.Lock()
+
+    def request(self, route, params, session):
+        url = f"{self.base_url}{route}?{urlencode(params)}"
+        started = time.perf_counter()
+        try:
+            with urlopen(Request(url, headers={"X-Session-Id": session}), timeout=self.args.timeout) as response:
+                body = response.read()
+                ok = True
+        except HTTPError as e:
+            body = e.read()
+            ok = False
+        except OSError:
+            body = b""
+            ok = False
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples[route].append(elapsed)
+            self.errors[route] += not ok
+        return body if ok else None
+
+    def user(self, index):
+        rng = random.Random(index)
+        session = f"bench-{index}"
+        cities = list(CITIES)[: self.args.locations]
+        for _ in range(self.args.iterations):
+            city = rng.choice(cities)
+            first = date.today() + timedelta(days=rng.randrange(3))
+            days = {"start_date": f"{first:%B %d %Y}", "end_date": f"{first + timedelta(days=2):%B %d %Y}"}
+            events = self.request("/get-events", dict(days, address=city), session)
+
+            lat, lon = city_center(city)
+            self.request("/get-itinerary", dict(
+                days,
+                current_location=f"{lat},{lon}",
+                time="6",
+                start_time="01:00 PM",
+                planner=self.args.planner,
+            ), session)
+
+            address = city
+            if events:
+                located = json.loads(events)
+                if located:
+                    address = ", ".join(rng.choice(located).get("address") or [city])
+            self.request("/get-coordinates", {"address": address}, session)
+
+    def run(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.users) as pool:
+            list(pool.map(self.user, range(self.args.users)))
+        return time.perf_counter() - started
+
+
+def stage_means(exposition):
+    """Mean seconds and count per stage from the /metrics text."""
+    sums, counts = {}, {}
+    for line in exposition.splitlines():
+        match = re.match(r'eventopia_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)', line)
+        if match:
+            (sums if match.group(1) == "sum" else counts)[match.group(2)] = float(match.group(3))
+    return {stage: (sums[stage] / counts[stage], int(counts[stage])) for stage in counts if counts[stage]}
+
+
+def start_app(args):
+    """Points the app at the stand-ins and serves it over HTTP from a scratch directory."""
+    events_fixture = load_events_fixture(args.events_fixture) if args.events_fixture else None
+    serpapi = StubServer(
+        serpapi_answer(lambda city: events_fixture or synthetic_events(city, args.events)),
+        Fault(args.serpapi_latency_ms, args.serpapi_error_rate, seed=1),
+    )
+    nominatim = StubServer(nominatim_answer, Fault(args.geocode_latency_ms, args.geocode_error_rate, seed=2))
+
+    # Paths and limits are read at import time, so set them before importing the app
+    os.chdir(tempfile.mkdtemp(prefix="eventopia-bench-"))
+    os.environ.update({
+        "API_KEY": "benchmark",
+        "SEARCH_API_KEY": "benchmark",
+        "NOMINATIM_DOMAIN": nominatim.address,
+        "NOMINATIM_SCHEME": "http",
+        "NOMINATIM_RPS": str(args.nominatim_rps),
+        "GEMINI_RPM": str(args.gemini_rpm),
+    })
+    sys.path.insert(0, BACKEND)
+    from serpapi.serp_api_client import SerpApiClient
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    import functions
+    import llm
+
+    SerpApiClient.BACKEND = f"http://{serpapi.address}"
+    itinerary = load_itinerary_fixture(args.itinerary_fixture)
+    gemini_fault = Fault(args.gemini_latency_ms, args.gemini_error_rate, seed=3)
+    for name in llm.MODELS:
+        llm._models[(name, None)] = GeminiStub(name, gemini_fault, itinerary)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log(self, *args):
+            pass
+
+    server = make_server("127.0.0.1", 0, functions.create_app(), threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=8, help="Concurrent virtual users")
+    parser.add_argument("--iterations", type=int, default=5, help="Request sequences per user")
+    parser.add_argument("--locations", type=int, default=3, help="Distinct cities searched (1-6)")
+    parser.add_argument("--planner", default="local", choices=["local", "llm"])
+    parser.add_argument("--events", type=int, default=20, help="Synthesized results per search")
+    parser.add_argument("--events-fixture", help="Recorded SerpAPI events_results JSON to replay instead")
+    parser.add_argument("--itinerary-fixture", default=ITINERARY_FIXTURE)
+    parser.add_argument("--serpapi-latency-ms", type=float, default=800)
+    parser.add_argument("--serpapi-error-rate", type=float, default=0.0)
+    parser.add_argument("--geocode-latency-ms", type=float, default=150)
+    parser.add_argument("--geocode-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=1500)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--nominatim-rps", type=float, default=50, help="App-side Nominatim limit for the stub")
+    parser.add_argument("--gemini-rpm", type=float, default=6000, help="App-side Gemini request budget")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's own log output")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit 1 if any route's p95 exceeds this")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as quiet:
+        if not args.verbose:
+            quiet.enter_context(contextlib.redirect_stdout(open(os.devnull, "w")))
+        base_url = start_app(args)
+        driver = LoadDriver(base_url, args)
+        wall = driver.run()
+    with urlopen(f"{base_url}/metrics") as response:
+        stages = stage_means(response.read().decode())
+
+    report = {"wall_s": round(wall, 3), "routes": {}, "stages": {}}
+    for route in ROUTES:
+        ms = [s * 1000 for s in driver.samples[route]]
+        report["routes"][route] = {
+            "requests": len(ms),
+            "errors": driver.errors[route],
+            "p50_ms": round(percentile(ms, 50), 1),
+            "p95_ms": round(percentile(ms, 95), 1),
+            "p99_ms": round(percentile(ms, 99), 1),
+            "max_ms": round(max(ms), 1),
+            "throughput_rps": round(len(ms) / wall, 2),
+        }
+    total = sum(r["requests"] for r in report["routes"].values())
+    report["throughput_rps"] = round(total / wall, 2)
+    report["stages"] = {stage: {"mean_ms": round(mean * 1000, 1), "count": n} for stage, (mean, n) in stages.items()}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{args.users} users x {args.iterations} iterations, {total} requests in {wall:.2f}s ({report['throughput_rps']} req/s)")
+        print(f"{'route':<18}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>8}")
+        for route, r in report["routes"].items():
+            print(
+                f"{route:<18}{r['requests']:>6}{r['errors']:>6}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+                f"{r['p99_ms']:>10}{r['max_ms']:>10}{r['throughput_rps']:>8}"
+            )
+        print("stage means:")
+        for stage, s in sorted(report["stages"].items(), key=lambda item: -item[1]["mean_ms"] * item[1]["count"]):
+            print(f"  {stage:<20}{s['mean_ms']:>10} ms  x{s['count']}")
+
+    if args.max_p95_ms is not None:
+        slow = [route for route, r in report["routes"].items() if r["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"FAIL: p95 above {args.max_p95_ms} ms for {', '.join(slow)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
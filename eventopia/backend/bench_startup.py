@@ -0,0 +1,70 @@
+"""Cold-start benchmark: import time, app creation and first-request latency.
+
+Each run is a fresh interpreter, like a newly scaled-up worker. Also reports
+which heavy modules were loaded by importing the app and by the first
+request. Usage: python bench_startup.py [--runs 5] [--path /search-cache-stats]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["google.generativeai", "serpapi", "geopy", "geocoder", "numpy"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import functions
+imported = time.perf_counter()
+heavy = json.loads(sys.argv[2])
+at_import = [m for m in heavy if m in sys.modules]
+app = functions.create_app()
+created = time.perf_counter()
+with app.test_client() as client:
+    status = client.get(sys.argv[1]).status_code
+finished = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "create_app_s": created - imported,
+    "first_request_s": finished - created,
+    "status": status,
+    "loaded_at_import": at_import,
+    "loaded_after_request": [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+def run_once(path):
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.setdefault("API_KEY", "benchmark")
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", PROBE, path, json.dumps(HEAVY_MODULES)],
+        cwd=backend,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/search-cache-stats", help="Route used as the first request")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    for key in ("import_s", "create_app_s", "first_request_s"):
+        values = [r[key] * 1000 for r in runs]
+        print(f"{key[:-2]:>14}: median {statistics.median(values):7.1f} ms   max {max(values):7.1f} ms")
+    print(f"{'status':>14}: {runs[-1]['status']} for GET {args.path}")
+    print(f"{'at import':>14}: {', '.join(runs[-1]['loaded_at_import']) or 'no heavy modules'}")
+    print(f"{'after request':>14}: {', '.join(runs[-1]['loaded_after_request']) or 'no heavy modules'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Incremental Chrome history ingestion into a compact, persisted interest profile.
+
+Chrome's History database is opened read-only in place (SQLite immutable URI
+mode, so no copy and no lock on Chrome's file). Only visits newer than the
+stored watermark are read, and their domains and title terms are folded into
+running totals in a single pass.
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlparse
+
+PROFILE_PATH = os.getenv("HISTORY_PROFILE_PATH", "json_output/history_profile.db")
+BATCH_SIZE = 1000
+TOP_DOMAINS = 30
+TOP_TERMS = 60
+TERM_RE = re.compile(r"[a-z][a-z'&-]{2,}")
+STOPWORDS = {
+    "the", "and", "for", "you", "your", "with", "from", "this", "that", "are", "was", "www",
+    "com", "http", "https", "html", "index", "home", "page", "new", "tab", "login", "sign",
+    "search", "google", "results", "how", "what", "why", "who", "all", "not", "can", "our",
+    "near", "best", "top", "free", "online", "official", "site",
+}
+CHROME_EPOCH = datetime(1601, 1, 1)
+
+
+def chrome_history_path():
+    """Default profile History file for Windows, macOS and Linux (CHROME_HISTORY_PATH overrides)."""
+    if os.getenv("CHROME_HISTORY_PATH"):
+        return os.getenv("CHROME_HISTORY_PATH")
+    if os.name == "nt":
+        return os.path.expanduser(r"~\AppData\Local\Google\Chrome\User Data\Default\History")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Application Support/Google/Chrome/Default/History")
+    for candidate in ("~/.config/google-chrome/Default/History", "~/.config/chromium/Default/History"):
+        if os.path.exists(os.path.expanduser(candidate)):
+            return os.path.expanduser(candidate)
+    return os.path.expanduser("~/.config/google-chrome/Default/History")
+
+
+def open_history(path):
+    """Read-only connection to a History file without copying it."""
+    uri = "file:" + quote(os.path.abspath(path).replace(os.sep, "/")) + "?mode=ro&immutable=1"
+    return sqlite3.connect(uri, uri=True)
+
+
+def chrome_time(value):
+    """Chrome timestamps are microseconds since 1601-01-01."""
+    return (CHROME_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def title_terms(title):
+    return [t for t in TERM_RE.findall((title or "").lower()) if t not in STOPWORDS]
+
+
+class HistoryProfile:
+    """Running visit counts per domain and title term, plus the ingestion watermark."""
+
+    def __init__(self, path=PROFILE_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS watermark (
+                source TEXT PRIMARY KEY,
+                last_visit_time INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS domains (
+                domain TEXT PRIMARY KEY,
+                visits INTEGER NOT NULL,
+                last_visit_time INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                visits INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def watermark(self, source):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_visit_time FROM watermark WHERE source = ?", (source,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def ingest(self, history_path=None, batch_size=BATCH_SIZE):
+        """Folds visits newer than the watermark into the profile; returns how many were read."""
+        history_path = history_path or chrome_history_path()
+        source = os.path.abspath(history_path)
+        since = self.watermark(source)
+
+        domains = Counter()
+        domain_last = {}
+        terms = Counter()
+        newest = since
+        read = 0
+        conn = open_history(history_path)
+        try:
+            cursor = conn.execute(
+                """
+                SELECT urls.url, urls.title, visits.visit_time
+                FROM visits JOIN urls ON urls.id = visits.url
+                WHERE visits.visit_time > ?
+                ORDER BY visits.visit_time
+                """,
+                (since,),
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for url, title, visit_time in rows:
+                    domain = urlparse(url).netloc.removeprefix("www.")
+                    if domain:
+                        domains[domain] += 1
+                        domain_last[domain] = visit_time
+                    terms.update(set(title_terms(title)))
+                    newest = visit_time
+                read += len(rows)
+        finally:
+            conn.close()
+
+        if not read:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO domains VALUES (?, ?, ?)
+                ON CONFLICT(domain) DO UPDATE SET
+                    visits = visits + excluded.visits, last_visit_time = excluded.last_visit_time
+                """,
+                [(d, n, domain_last[d]) for d, n in domains.items()],
+            )
+            self._conn.executemany(
+                """
+                INSERT INTO terms VALUES (?, ?)
+                ON CONFLICT(term) DO UPDATE SET visits = visits + excluded.visits
+                """,
+                terms.items(),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watermark VALUES (?, ?, ?)", (source, newest, time.time())
+            )
+        return read
+
+    def compact(self, top_domains=TOP_DOMAINS, top_terms=TOP_TERMS):
+        """The profile as a small dict: top domains and title terms by visits."""
+        with self._lock:
+            domains = self._conn.execute(
+                "SELECT domain, visits FROM domains ORDER BY visits DESC, domain LIMIT ?", (top_domains,)
+            ).fetchall()
+            terms = self._conn.execute(
+                "SELECT term, visits FROM terms ORDER BY visits DESC, term LIMIT ?", (top_terms,)
+            ).fetchall()
+            total, newest = self._conn.execute(
+                "SELECT COALESCE(SUM(visits), 0), MAX(last_visit_time) FROM domains"
+            ).fetchone()
+        return {
+            "visits": total,
+            "last_visit_time": chrome_time(newest) if newest else None,
+            "domains": [{"domain": d, "visits": n} for d, n in domains],
+            "terms": [{"term": t, "visits": n} for t, n in terms],
+        }
+
+
+_shared_profile = None
+_shared_lock = threading.Lock()
+
+
+def history_profile():
+    """Returns the process-wide history profile, opening it on first use."""
+    global _shared_profile
+    with _shared_lock:
+        if _shared_profile is None:
+            _shared_profile = HistoryProfile()
+        return _shared_profile
@@ -0,0 +1,28 @@
+"""Event categories, one per map pin."""
+import re
+
+# Mirrors src/assets/pins and MapBoxComp.typeToImgConverter
+CATEGORIES = [
+    "Concerts & Live Music",
+    "Theater & Performing Arts",
+    "Movie Screenings",
+    "Theme Park Events",
+    "Sports & Fitness",
+    "Food & Drink",
+    "Social & Networking",
+    "Technology & Innovation",
+    "Education & Learning",
+    "Arts & Creativity",
+    "Outdoor Hiking & Camping",
+    "Outdoor Water Sports Activities",
+    "Family & Kids",
+    "Nightlife & Parties",
+]
+_CATEGORY_LOOKUP = {re.sub(r"[^a-z]", "", c.lower().replace("&", "and")): c for c in CATEGORIES}
+
+
+def canonical_category(label):
+    """Maps a model-produced label onto CATEGORIES, or None if it matches nothing."""
+    if not isinstance(label, str):
+        return None
+    return _CATEGORY_LOOKUP.get(re.sub(r"[^a-z]", "", label.lower().replace("&", "and")))
@@ -0,0 +1,170 @@
+"""Incremental, chunked event categorization with a per-event category cache."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from categories import CATEGORIES, canonical_category
+from projection import event_fingerprint, project_event, report_savings, compact_json, CATEGORIZE_FIELDS
+from classifier import event_classifier, CONFIDENCE_THRESHOLD
+from metrics import carry, count_cache, span
+from llm import generate_json, LLMOutputError, SchedulerBusy, BACKGROUND, CATEGORIZED_EVENTS_SCHEMA
+
+CATEGORY_CACHE_PATH = os.getenv("CATEGORY_CACHE_PATH", "json_output/categories.db")
+CHUNK_SIZE = 20
+CATEGORIZE_WORKERS = 4
+
+
+def compact_event(event, event_id):
+    """The few fields the model needs to pick a category."""
+    return dict(project_event(event, CATEGORIZE_FIELDS), id=event_id)
+
+
+class CategoryCache:
+    """SQLite map from event fingerprint to category."""
+
+    def __init__(self, path=CATEGORY_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS categories (
+                fingerprint TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, fingerprints):
+        fingerprints = list(set(fingerprints))
+        if not fingerprints:
+            return {}
+        placeholders = ",".join("?" * len(fingerprints))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT fingerprint, category FROM categories WHERE fingerprint IN ({placeholders})",
+                fingerprints,
+            ).fetchall()
+        return dict(rows)
+
+    def put_many(self, mapping):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO categories VALUES (?, ?, ?)",
+                [(fp, category, now) for fp, category in mapping.items()],
+            )
+            self._conn.commit()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def category_cache():
+    """Returns the process-wide category cache, opening it on first use."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = CategoryCache()
+        return _shared_cache
+
+
+def build_query(chunk):
+    return (
+        "Categorize each event below into exactly one of these categories: "
+        f"{json.dumps(CATEGORIES)}. "
+        f"Events: {compact_json(chunk)} "
+        'Return a JSON array with one {"id": ..., "category": ...} object per event.'
+    )
+
+
+def categorize_chunk(model, chunk):
+    """Asks the model for one chunk; returns {id: canonical category}."""
+    try:
+        rows = generate_json(
+            model,
+            build_query(chunk),
+            "categorize",
+            CATEGORIZED_EVENTS_SCHEMA,
+            drop_invalid_items=True,
+            priority=BACKGROUND,
+        )
+    except (LLMOutputError, SchedulerBusy) as e:
+        print(f"ERROR: Categorization chunk failed: {e}")
+        return {}
+    ids = {event["id"] for event in chunk}
+    result = {}
+    for row in rows:
+        category = canonical_category(row["category"])
+        if row["id"] in ids and category:
+            result[row["id"]] = category
+    return result
+
+
+def categorize(
+    events,
+    model,
+    chunk_size=CHUNK_SIZE,
+    workers=CATEGORIZE_WORKERS,
+    threshold=CONFIDENCE_THRESHOLD,
+):
+    """Sets `category` on each event in place; only uncertain, uncached events go to the model.
+
+    Every event is scored by the local classifier, whose version and
+    confidence are recorded on it. Cached categories win; otherwise a
+    classifier label at or above `threshold` is used as-is. The remaining
+    events are sent as compact rows in chunks of `chunk_size`, `workers`
+    chunks at a time. Events the model fails to categorize keep the
+    classifier's guess and are retried on the next call.
+    """
+    classifier = event_classifier()
+    guesses, confidences = classifier.predict(events)
+    fingerprints = [event_fingerprint(event) for event in events]
+    known = category_cache().get_many(fingerprints)
+    count_cache("category", True, len(known))
+    count_cache("category", False, len(set(fingerprints)) - len(known))
+
+    pending = {}
+    pending_events = []
+    for event, fp, guess, confidence in zip(events, fingerprints, guesses, confidences):
+        event["classifier_version"] = classifier.version
+        event["category_confidence"] = round(float(confidence), 3)
+        if fp in known:
+            event["category"] = known[fp]
+            event["category_source"] = "gemini"
+            continue
+        event["category"] = guess
+        event["category_source"] = "classifier"
+        if confidence < threshold and fp not in pending:
+            pending[fp] = compact_event(event, fp)
+            pending_events.append(event)
+
+    rows = list(pending.values())
+    if rows:
+        report_savings("categorize", pending_events, rows)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    learned = {}
+    if chunks:
+        with span("categorize_llm"), ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+            for mapping in pool.map(carry(lambda chunk: categorize_chunk(model, chunk)), chunks):
+                learned.update(mapping)
+        category_cache().put_many(learned)
+
+    for event, fp in zip(events, fingerprints):
+        if fp in learned:
+            event["category"] = learned[fp]
+            event["category_source"] = "gemini"
+
+    print(
+        f"Categorized {len(events)} events: {len(known)} cached, "
+        f"{len(events) - len(known) - len(rows)} by classifier, "
+        f"{len(learned)}/{len(rows)} by Gemini in {len(chunks)} chunks"
+    )
+    return events
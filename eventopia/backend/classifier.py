@@ -0,0 +1,172 @@
+"""Local keyword/TF-IDF event classifier, scored in batch with NumPy.
+
+Seed keywords give every category a prior; training on previously categorized
+events (e.g. accumulated events_results.json files) adds TF-IDF centroids on
+top. Usage: python classifier.py json_output/events_results.json [...]
+"""
+import json
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+
+from categories import CATEGORIES, canonical_category
+
+MODEL_PATH = os.getenv("CLASSIFIER_PATH", "json_output/classifier.npz")
+BASE_VERSION = "kw-tfidf-1"
+CONFIDENCE_THRESHOLD = 0.7
+SHARPNESS = 1.5  # Softmax temperature over weighted keyword hits
+TITLE_WEIGHT = 2.0
+
+SEED_KEYWORDS = {
+    "Concerts & Live Music": "concert music band live jazz orchestra symphony tour singer songwriter bluegrass rock choir acoustic album guitar hip hop rapper",
+    "Theater & Performing Arts": "theater theatre musical broadway play ballet dance opera comedy comedian improv performance stage",
+    "Movie Screenings": "film movie screening cinema documentary premiere",
+    "Theme Park Events": "theme amusement carnival fair ride coaster",
+    "Sports & Fitness": "run 5k 10k race marathon yoga fitness basketball football soccer baseball hockey workout parkrun tournament match",
+    "Food & Drink": "food drink beer wine brewery tasting dinner brunch cocktail chef cooking restaurant farmer taco",
+    "Social & Networking": "networking meetup mixer single dating social community mingle",
+    "Technology & Innovation": "tech technology ai startup hackathon coding developer data software innovation blockchain",
+    "Education & Learning": "workshop class lecture seminar course learn talk library training university",
+    "Arts & Creativity": "art gallery exhibit exhibition painting craft museum artist photography pottery creative",
+    "Outdoor Hiking & Camping": "hike hiking trail camping nature outdoor creek garden bird",
+    "Outdoor Water Sports Activities": "kayak paddle canoe swim lake river boat fishing surf sailing",
+    "Family & Kids": "kid family child children storytime toddler teen parent",
+    "Nightlife & Parties": "party nightlife club dj bar night rave drag karaoke trivia",
+}
+
+
+def tokenize(text):
+    tokens = re.findall(r"[a-z0-9]+", (text or "").lower())
+    # Crude plural folding so "concerts" hits "concert"
+    return [t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t for t in tokens]
+
+
+def event_terms(event):
+    """Weighted term counts for an event's title, venue name and description."""
+    terms = {}
+    weighted_texts = [
+        (event.get("title"), TITLE_WEIGHT),
+        ((event.get("venue") or {}).get("name"), 1.0),
+        (event.get("description"), 1.0),
+    ]
+    for text, weight in weighted_texts:
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0.0) + weight
+    return terms
+
+
+class EventClassifier:
+    """Linear scorer: category scores are term counts times a weight matrix."""
+
+    def __init__(self, vocab, weights, version):
+        self.vocab = list(vocab)
+        self.index = {term: i for i, term in enumerate(self.vocab)}
+        self.weights = weights  # (n_categories, n_terms)
+        self.version = version
+
+    @classmethod
+    def from_seeds(cls):
+        vocab = sorted({t for words in SEED_KEYWORDS.values() for t in tokenize(words)})
+        index = {term: i for i, term in enumerate(vocab)}
+        weights = np.zeros((len(CATEGORIES), len(vocab)))
+        for c, category in enumerate(CATEGORIES):
+            for term in tokenize(SEED_KEYWORDS[category]):
+                weights[c, index[term]] = 1.0
+        return cls(vocab, weights, BASE_VERSION)
+
+    def vectorize(self, events):
+        """Term-count matrix (n_events, n_terms) over this classifier's vocabulary."""
+        matrix = np.zeros((len(events), len(self.vocab)))
+        for row, event in enumerate(events):
+            for term, count in event_terms(event).items():
+                col = self.index.get(term)
+                if col is not None:
+                    matrix[row, col] = count
+        return matrix
+
+    def predict(self, events):
+        """Returns (categories, confidences) for a batch of events."""
+        if not events:
+            return [], np.zeros(0)
+        scores = self.vectorize(events) @ self.weights.T * SHARPNESS
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        return [CATEGORIES[i] for i in best], probs[np.arange(len(events)), best]
+
+    def train(self, events):
+        """Returns a new classifier with TF-IDF centroids learned from labelled events."""
+        # Skip the classifier's own labels so it does not train on itself
+        labelled = [
+            (e, canonical_category(e.get("category")))
+            for e in events
+            if e.get("category_source") != "classifier"
+        ]
+        labelled = [(e, c) for e, c in labelled if c]
+        if not labelled:
+            return self
+
+        vocab = sorted(set(self.vocab) | {t for e, _ in labelled for t in event_terms(e)})
+        trained = EventClassifier(vocab, None, None)
+        seeds = np.zeros((len(CATEGORIES), len(vocab)))
+        seeds[:, [trained.index[t] for t in self.vocab]] = self.weights
+
+        counts = trained.vectorize([e for e, _ in labelled])
+        doc_freq = (counts > 0).sum(axis=0)
+        idf = np.log((1 + len(labelled)) / (1 + doc_freq)) + 1
+        tfidf = counts * idf
+        tfidf /= np.maximum(np.linalg.norm(tfidf, axis=1, keepdims=True), 1e-9)
+
+        labels = np.array([CATEGORIES.index(c) for _, c in labelled])
+        centroids = np.zeros_like(seeds)
+        for c in np.unique(labels):
+            centroids[c] = tfidf[labels == c].mean(axis=0)
+        centroids /= np.maximum(centroids.max(axis=1, keepdims=True), 1e-9)
+
+        trained.weights = seeds + centroids
+        trained.version = f"{BASE_VERSION}+{len(labelled)}"
+        return trained
+
+    def save(self, path=MODEL_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path, vocab=np.array(self.vocab), weights=self.weights, version=np.array(self.version)
+        )
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        data = np.load(path)
+        return cls(data["vocab"].tolist(), data["weights"], str(data["version"]))
+
+
+_shared_classifier = None
+_shared_lock = threading.Lock()
+
+
+def event_classifier():
+    """Returns the trained classifier from MODEL_PATH, or the seed-only one."""
+    global _shared_classifier
+    with _shared_lock:
+        if _shared_classifier is None:
+            if os.path.exists(MODEL_PATH):
+                _shared_classifier = EventClassifier.load(MODEL_PATH)
+            else:
+                _shared_classifier = EventClassifier.from_seeds()
+        return _shared_classifier
+
+
+if __name__ == "__main__":
+    events = []
+    for path in sys.argv[1:]:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        events.extend(data if isinstance(data, list) else data.get("events", []))
+
+    classifier = EventClassifier.from_seeds().train(events)
+    classifier.save()
+    print(f"Trained {classifier.version} on {len(events)} events, saved to {MODEL_PATH}")
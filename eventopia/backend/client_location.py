@@ -0,0 +1,209 @@
+"""Where the client is: from coordinates it supplied, or from its IP address.
+
+Replaces server-side `geocoder.ip("me")`, which cost an HTTP round trip per
+request and located the server rather than the user. Results are kept in a
+TTL cache keyed by client and IP prefix (/24 for IPv4, /48 for IPv6), so a
+client's supplied coordinates stick to it and IP lookups are shared by
+neighbours. Public IPs are looked up in a local GeoLite2 City database when
+IP_DB_PATH is set (needs the optional `geoip2` package), else online. Private
+and loopback clients share the server's network, so they are located as the
+server, once per TTL.
+"""
+import ipaddress
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from geocoding import nominatim, nominatim_limiter
+from metrics import count_cache, span
+
+IP_DB_PATH = os.getenv("IP_DB_PATH")  # e.g. GeoLite2-City.mmdb
+CLIENT_LOCATION_TTL = float(os.getenv("CLIENT_LOCATION_TTL", 6 * 3600))
+NEGATIVE_TTL = 15 * 60  # Retry failed lookups sooner
+CACHE_SIZE = 4096
+SERVER = "me"  # Prefix key for clients located as the server
+CELL_DECIMALS = 2  # Supplied coordinates share reverse lookups within ~1 km
+
+
+def ip_prefix(ip):
+    """Network an address is cached under; SERVER for private, loopback or missing addresses."""
+    try:
+        address = ipaddress.ip_address((ip or "").strip())
+    except ValueError:
+        return SERVER
+    if address.is_private or address.is_loopback or address.is_link_local:
+        return SERVER
+    bits = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{bits}", strict=False))
+
+
+def parse_coordinates(latitude, longitude):
+    """(lat, lon) as floats, or (None, None) when either is missing.
+
+    Raises ValueError for values that are not numbers or are out of range.
+    """
+    if latitude in (None, "") or longitude in (None, ""):
+        return None, None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError("lat and long must be numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("lat must be within [-90, 90] and long within [-180, 180]")
+    return latitude, longitude
+
+
+def location_label(location, fallback="USA"):
+    """"City, State" for the events search, as the old geocoder.ip code built it."""
+    if location and location.get("city") and location.get("state"):
+        return f"{location['city']}, {location['state']}"
+    return fallback
+
+
+def location_latlng(location):
+    if location and location.get("latitude") is not None and location.get("longitude") is not None:
+        return [location["latitude"], location["longitude"]]
+    return None
+
+
+def _location(source, city=None, state=None, country=None, latitude=None, longitude=None):
+    return {
+        "city": city,
+        "state": state,
+        "country": country,
+        "latitude": latitude,
+        "longitude": longitude,
+        "source": source,
+    }
+
+
+_ip_db = None
+_ip_db_lock = threading.Lock()
+
+
+def lookup_offline(ip):
+    """City record from the local IP database, or None."""
+    global _ip_db
+    with _ip_db_lock:
+        if _ip_db is None:
+            import geoip2.database
+
+            _ip_db = geoip2.database.Reader(IP_DB_PATH)
+    try:
+        record = _ip_db.city(ip)
+    except Exception:  # geoip2.errors.AddressNotFoundError and malformed addresses
+        return None
+    return _location(
+        "ip_db",
+        record.city.name,
+        record.subdivisions.most_specific.name,
+        record.country.iso_code,
+        record.location.latitude,
+        record.location.longitude,
+    )
+
+
+def lookup_online(ip):
+    """City record from the online IP service (ipinfo via geocoder), or None."""
+    import geocoder
+
+    with span("ip_lookup"):
+        g = geocoder.ip(ip)
+    if not g.ok:
+        return None
+    latlng = g.latlng or [None, None]
+    return _location("ip", g.city, g.state, g.country, latlng[0], latlng[1])
+
+
+def reverse_lookup(latitude, longitude):
+    """City record for coordinates via Nominatim; keeps the coordinates even if that fails."""
+    location = _location("coordinates", latitude=latitude, longitude=longitude)
+    nominatim_limiter.acquire()
+    try:
+        with span("geocode_attempt"):
+            place = nominatim().reverse((latitude, longitude), language="en", zoom=10)
+    except Exception as e:
+        print(f"ERROR: Reverse geocoding {latitude}, {longitude} failed: {e}")
+        return location
+    address = (place.raw.get("address", {}) if place else {}) or {}
+    location["city"] = address.get("city") or address.get("town") or address.get("village")
+    location["state"] = address.get("state")
+    location["country"] = address.get("country_code", "").upper() or None
+    return location
+
+
+class ClientLocationCache:
+    """TTL LRU of resolved locations keyed by (client, IP prefix)."""
+
+    def __init__(self, ttl=CLIENT_LOCATION_TTL, negative_ttl=NEGATIVE_TTL, max_entries=CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, location):
+        ttl = self.ttl if location_latlng(location) else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (location, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+client_location_cache = ClientLocationCache()
+
+
+def resolve_client_location(ip, client=None, latitude=None, longitude=None, reverse=True):
+    """Location dict (city, state, country, latitude, longitude, source) for a client.
+
+    Supplied coordinates win (ValueError if they are invalid, see
+    parse_coordinates). Only when `reverse` is set (a place name is
+    needed) are they reverse geocoded, shared per ~1 km cell, and remembered
+    for this client and prefix. Without coordinates the client's own entry is
+    used, then the prefix's, then an IP lookup.
+    """
+    prefix = ip_prefix(ip)
+    latitude, longitude = parse_coordinates(latitude, longitude)
+    if latitude is not None:
+        location = _location("coordinates", latitude=latitude, longitude=longitude)
+        if not reverse:
+            return location
+        cell = ("cell", round(latitude, CELL_DECIMALS), round(longitude, CELL_DECIMALS))
+        place = client_location_cache.get(cell)
+        count_cache("client_location", place is not None)
+        if place is None:
+            place = reverse_lookup(latitude, longitude)
+            client_location_cache.put(cell, place)
+        location.update(city=place["city"], state=place["state"], country=place["country"])
+        client_location_cache.put((client, prefix), location)
+        return location
+
+    for key in ((client, prefix), (None, prefix)):
+        cached = client_location_cache.get(key)
+        if cached is not None:
+            count_cache("client_location", True)
+            return cached
+    count_cache("client_location", False)
+
+    location = None
+    try:
+        if prefix != SERVER and IP_DB_PATH:
+            location = lookup_offline(ip)
+        else:
+            location = lookup_online(SERVER if prefix == SERVER else ip)
+    except Exception as e:
+        print(f"ERROR: IP geolocation for {prefix} failed: {e}")
+    location = location or _location("unknown")
+    client_location_cache.put((None, prefix), location)
+    return location
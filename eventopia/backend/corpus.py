@@ -0,0 +1,388 @@
+"""Append-only event corpus with date, category and geohash indexes.
+
+Every geocoded event seen by a search is stored once, keyed by its
+fingerprint, in SQLite. Searches are recorded as coverage so that a later
+/get-events for the same location and dates can be answered from the corpus
+instead of SerpAPI. Snapshots for bulk loading are columnar NumPy archives.
+Usage: python corpus.py export|import snapshot.npz
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from categories import canonical_category
+from event_time import DEFAULT_DURATION
+from projection import event_fingerprint
+from spatial import distance_km, KM_PER_DEGREE
+
+CORPUS_PATH = os.getenv("EVENT_CORPUS_PATH", "json_output/corpus.db")
+COVERAGE_TTL = float(os.getenv("CORPUS_COVERAGE_TTL", 12 * 3600))  # How long a search answers repeats
+GEOHASH_PRECISION = 5  # ~4.9 km x 4.9 km cells
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+MAX_GEOHASH_CELLS = 64  # Wider radius queries switch to coarser (prefix) cells
+
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """Standard base-32 geohash of a point."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def _cover_grid(lat, radius_km, precision):
+    """(dlat, dlon, lat_step, lon_step, rows, cols) of the cell grid over a circle's bounding box."""
+    lat_step = 180.0 / 2 ** (5 * precision // 2)
+    lon_step = 360.0 / 2 ** (5 * precision - 5 * precision // 2)
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    rows = int(math.ceil(2 * dlat / lat_step)) + 1
+    cols = int(math.ceil(2 * dlon / lon_step)) + 1
+    return dlat, dlon, lat_step, lon_step, rows, cols
+
+
+def geohash_cells(lat, lon, radius_km, precision=GEOHASH_PRECISION):
+    """Geohash cells covering the bounding box of a circle."""
+    dlat, dlon, lat_step, lon_step, rows, cols = _cover_grid(lat, radius_km, precision)
+    cells = set()
+    for r in range(rows + 1):
+        for c in range(cols + 1):
+            cells.add(geohash(
+                max(min(lat - dlat + r * lat_step, 90.0), -90.0),
+                (lon - dlon + c * lon_step + 180.0) % 360.0 - 180.0,
+                precision,
+            ))
+    return cells
+
+
+def geohash_cover(lat, lon, radius_km, max_cells=MAX_GEOHASH_CELLS):
+    """(precision, cells) covering a circle in at most `max_cells` cells, coarser as the radius grows.
+
+    Returns (None, None) when not even single-character cells are few enough
+    (or the radius is not a finite, non-negative number); callers then skip
+    the cell filter.
+    """
+    if not (radius_km >= 0 and math.isfinite(radius_km)):
+        return None, None
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        *_, rows, cols = _cover_grid(lat, radius_km, precision)
+        if (rows + 1) * (cols + 1) <= max_cells:
+            return precision, geohash_cells(lat, lon, radius_km, precision)
+    return None, None
+
+
+def location_key(user_location):
+    return re.sub(r"\s+", " ", str(user_location).lower()).strip(" ,")
+
+
+def named_window(name, now=None):
+    """(start, end) datetimes for "today", "tomorrow", "weekend" or "week"."""
+    now = now or datetime.now()
+    today = datetime.combine(now.date(), datetime.min.time())
+    if name == "tomorrow":
+        return today + timedelta(days=1), today + timedelta(days=2) - timedelta(minutes=1)
+    if name == "weekend":
+        saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+        if today.weekday() == 6:
+            saturday = today - timedelta(days=1)
+        return max(saturday, now), saturday + timedelta(days=2) - timedelta(minutes=1)
+    if name == "week":
+        return now, today + timedelta(days=7) - timedelta(minutes=1)
+    return now, today + timedelta(days=1) - timedelta(minutes=1)
+
+
+def _day(value):
+    return value[:10] if value else None
+
+
+class EventCorpus:
+    """Events appended once by fingerprint, with secondary indexes for compound queries."""
+
+    def __init__(self, path=CORPUS_PATH, coverage_ttl=COVERAGE_TTL):
+        self.coverage_ttl = coverage_ttl
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                fingerprint TEXT PRIMARY KEY,
+                start_day TEXT,
+                end_day TEXT,
+                category TEXT,
+                geohash TEXT,
+                latitude REAL,
+                longitude REAL,
+                data TEXT NOT NULL,
+                ingested_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_start_day ON events (start_day);
+            CREATE INDEX IF NOT EXISTS events_category ON events (category);
+            CREATE INDEX IF NOT EXISTS events_geohash ON events (geohash);
+            CREATE TABLE IF NOT EXISTS event_locations (
+                location TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                PRIMARY KEY (location, fingerprint)
+            );
+            CREATE TABLE IF NOT EXISTS coverage (
+                location TEXT NOT NULL,
+                start_day TEXT NOT NULL,
+                end_day TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                event_count INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS coverage_location ON coverage (location, fetched_at);
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _row(event):
+        lat, lon = event.get("latitude"), event.get("longitude")
+        located = lat is not None and lon is not None
+        return (
+            event_fingerprint(event),
+            _day(event.get("start_datetime")),
+            _day(event.get("end_datetime")),
+            canonical_category(event.get("category") or ""),
+            geohash(lat, lon) if located else None,
+            lat if located else None,
+            lon if located else None,
+            json.dumps(event, ensure_ascii=False, separators=(",", ":")),
+            time.time(),
+        )
+
+    def append(self, events, user_location=None):
+        """Adds events not seen before; returns how many were new.
+
+        Existing events are never rewritten, except that a category or
+        coordinates learned later fill in a missing value.
+        """
+        rows = [self._row(event) for event in events]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            added = self._conn.total_changes - before
+            self._conn.executemany(
+                """
+                UPDATE events SET category = ?, data = ? WHERE fingerprint = ? AND category IS NULL AND ? IS NOT NULL
+                """,
+                [(r[3], r[7], r[0], r[3]) for r in rows],
+            )
+            self._conn.executemany(
+                """
+                UPDATE events SET geohash = ?, latitude = ?, longitude = ?, data = ?
+                WHERE fingerprint = ? AND geohash IS NULL AND ? IS NOT NULL
+                """,
+                [(r[4], r[5], r[6], r[7], r[0], r[4]) for r in rows],
+            )
+            if user_location is not None:
+                key = location_key(user_location)
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO event_locations VALUES (?, ?)", [(key, r[0]) for r in rows]
+                )
+        return added
+
+    def record_search(self, user_location, window_start, window_end, events):
+        """Appends a search's events and marks its location and days as covered."""
+        added = self.append(events, user_location)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                (
+                    location_key(user_location),
+                    window_start.date().isoformat(),
+                    window_end.date().isoformat(),
+                    time.time(),
+                    len(events),
+                ),
+            )
+        return added
+
+    def covers(self, user_location, window_start, window_end):
+        """True if a recent search for this location spanned the whole window."""
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT 1 FROM coverage
+                WHERE location = ? AND fetched_at >= ? AND start_day <= ? AND end_day >= ? AND event_count > 0
+                LIMIT 1
+                """,
+                (
+                    location_key(user_location),
+                    time.time() - self.coverage_ttl,
+                    window_start.date().isoformat(),
+                    window_end.date().isoformat(),
+                ),
+            ).fetchone()
+        return row is not None
+
+    def query(
+        self,
+        lat=None,
+        lon=None,
+        radius_km=None,
+        window_start=None,
+        window_end=None,
+        category=None,
+        user_location=None,
+        include_undated=False,
+        limit=None,
+    ):
+        """Events matching every given filter; radius queries are nearest first with `distance_km` set.
+
+        Without `window_end` the window is open-ended: events not over by `window_start`.
+
+        The geohash, day and category indexes narrow the candidates in SQL;
+        exact distances are then computed in one vectorized pass.
+        """
+        clauses, params, joins = [], [], ""
+        if user_location is not None:
+            joins = "JOIN event_locations l ON l.fingerprint = e.fingerprint AND l.location = ?"
+            params.append(location_key(user_location))
+        if radius_km is not None:
+            precision, cells = geohash_cover(lat, lon, radius_km)
+            if precision == GEOHASH_PRECISION:
+                clauses.append(f"e.geohash IN ({','.join('?' * len(cells))})")
+                params.extend(sorted(cells))
+            elif precision is not None:
+                # Coarser cells are prefixes: one indexed range per cell
+                clauses.append("(" + " OR ".join(["e.geohash BETWEEN ? AND ?"] * len(cells)) + ")")
+                for cell in sorted(cells):
+                    params.extend([cell, cell + "z" * (GEOHASH_PRECISION - precision)])
+        if window_start is not None:
+            dated = "COALESCE(e.end_day, e.start_day) >= ?"
+            params.append(window_start.date().isoformat())
+            if window_end is not None:
+                dated = f"(e.start_day <= ? AND {dated})"
+                params.insert(-1, window_end.date().isoformat())
+            clauses.append(f"({dated} OR e.start_day IS NULL)" if include_undated else dated)
+        if category is not None:
+            clauses.append("e.category = ?")
+            params.append(canonical_category(category) or category)
+
+        sql = f"SELECT e.data, e.latitude, e.longitude FROM events e {joins}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY e.start_day, e.fingerprint"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        events = [json.loads(row[0]) for row in rows]
+        if window_start is not None:
+            events = [e for e in events if _overlaps(e, window_start, window_end, include_undated)]
+        if radius_km is not None and events:
+            points = [(e["latitude"], e["longitude"]) for e in events]
+            distances = distance_km([(lat, lon)], points)[0]
+            order = np.argsort(distances, kind="stable")
+            events = [
+                dict(events[i], distance_km=round(float(distances[i]), 3))
+                for i in order if distances[i] <= radius_km
+            ]
+        return events[:limit] if limit else events
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def export_snapshot(self, path):
+        """Writes the corpus as a compressed columnar archive (no pickled objects)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fingerprint, start_day, end_day, category, geohash, latitude, longitude, data FROM events"
+            ).fetchall()
+        blobs = [row[7].encode("utf-8") for row in rows]
+        offsets = np.cumsum([0] + [len(b) for b in blobs]).astype(np.int64)
+        np.savez_compressed(
+            path,
+            fingerprint=np.array([r[0] for r in rows], dtype="U16"),
+            start_day=np.array([r[1] or "" for r in rows], dtype="U10"),
+            end_day=np.array([r[2] or "" for r in rows], dtype="U10"),
+            category=np.array([r[3] or "" for r in rows], dtype="U40"),
+            geohash=np.array([r[4] or "" for r in rows], dtype=f"U{GEOHASH_PRECISION}"),
+            latitude=np.array([np.nan if r[5] is None else r[5] for r in rows], dtype=float),
+            longitude=np.array([np.nan if r[6] is None else r[6] for r in rows], dtype=float),
+            data=np.frombuffer(b"".join(blobs), dtype=np.uint8),
+            offsets=offsets,
+        )
+        return len(rows)
+
+    def import_snapshot(self, path):
+        """Bulk-loads a snapshot in one transaction; events already present are kept. Returns how many were new."""
+        with np.load(path, allow_pickle=False) as archive:
+            columns = {name: archive[name] for name in archive.files}
+        data = columns["data"].tobytes()
+        offsets = columns["offsets"].tolist()
+        text = {name: columns[name].tolist() for name in ("fingerprint", "start_day", "end_day", "category", "geohash")}
+        lats = [None if math.isnan(v) else v for v in columns["latitude"].tolist()]
+        lons = [None if math.isnan(v) else v for v in columns["longitude"].tolist()]
+        now = time.time()
+        rows = [
+            (
+                text["fingerprint"][i],
+                text["start_day"][i] or None,
+                text["end_day"][i] or None,
+                text["category"][i] or None,
+                text["geohash"][i] or None,
+                lats[i],
+                lons[i],
+                data[offsets[i]:offsets[i + 1]].decode("utf-8"),
+                now,
+            )
+            for i in range(len(offsets) - 1)
+        ]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            return self._conn.total_changes - before
+
+
+def _overlaps(event, window_start, window_end, include_undated):
+    if not event.get("start_datetime"):
+        return include_undated
+    start = datetime.fromisoformat(event["start_datetime"])
+    end = datetime.fromisoformat(event["end_datetime"]) if event.get("end_datetime") else start + DEFAULT_DURATION
+    return (window_end is None or start <= window_end) and end >= window_start
+
+
+_shared_corpus = None
+_shared_lock = threading.Lock()
+
+
+def event_corpus():
+    """Returns the process-wide event corpus, opening it on first use."""
+    global _shared_corpus
+    with _shared_lock:
+        if _shared_corpus is None:
+            _shared_corpus = EventCorpus()
+        return _shared_corpus
+
+
+if __name__ == "__main__":
+    command, snapshot = sys.argv[1], sys.argv[2]
+    if command == "export":
+        print(f"Exported {event_corpus().export_snapshot(snapshot)} events to {snapshot}")
+    else:
+        print(f"Imported {event_corpus().import_snapshot(snapshot)} new events from {snapshot}")
@@ -0,0 +1,130 @@
+"""Concurrent SerpAPI Google Events page fetching."""
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import carry, span
+from search_cache import search_cache, search_key
+
+PAGE_SIZE = 10  # Google Events returns at most 10 results per page
+DEFAULT_PAGES = 2
+DEFAULT_CONCURRENCY = 4
+MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "5"))  # Upper bounds on what a request may ask for
+MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "4"))
+PAGE_RETRIES = 3
+BACKOFF_BASE = 0.5
+
+
+class SearchError(Exception):
+    """Raised when a results page could not be fetched (as opposed to having no results)."""
+
+
+def build_search_params(user_location, start_date, end_date, page):
+    """Builds the SerpAPI parameters for one page of an events search."""
+    return {
+        "engine": "google_events",
+        "q": f"Events in {user_location} between {start_date} to {end_date}",
+        "hl": "en",
+        "gl": "us",
+        "api_key": os.environ["SEARCH_API_KEY"],
+        "start": str(page * PAGE_SIZE),
+    }
+
+
+def search_page(params):
+    """Runs one SerpAPI request, raising SearchError on API errors other than "no results"."""
+    from serpapi import GoogleSearch
+
+    with span("search_page"):
+        results = GoogleSearch(params).get_dict()
+    error = results.get("error")
+    if error and "hasn't returned any results" not in error:
+        raise SearchError(error)
+    return results.get("events_results", [])
+
+
+def search_page_with_retries(params, retries=PAGE_RETRIES):
+    """search_page, retrying API and network errors with jittered backoff; SearchError once they run out."""
+    from requests import RequestException
+
+    for attempt in range(retries):
+        try:
+            return search_page(params)
+        except (SearchError, RequestException, ValueError) as e:  # ValueError: a non-JSON reply
+            print(f"ERROR: Events search failed for page starting at {params['start']} ({attempt+1}/{retries}): {e}")
+            if attempt + 1 == retries:
+                raise SearchError(f"page starting at {params['start']}: {e}") from e
+            time.sleep(random.uniform(0, BACKOFF_BASE * 2**attempt))
+
+
+def fetch_page(user_location, start_date, end_date, page):
+    """Fetches a single results page through the search cache and returns its list of events.
+
+    Raises SearchError if the page could not be fetched; a failed page is
+    never cached or mistaken for an empty one.
+    """
+    params = build_search_params(user_location, start_date, end_date, page)
+    key = search_key(user_location, start_date, end_date, page, params["hl"], params["gl"])
+    return search_cache.get_or_fetch(key, lambda: search_page_with_retries(params))
+
+
+def fetch_event_pages(
+    user_location,
+    start_date,
+    end_date,
+    pages=DEFAULT_PAGES,
+    concurrency=DEFAULT_CONCURRENCY,
+):
+    """Fetches up to `pages` result pages with at most `concurrency` requests in flight.
+
+    Both are clamped to MAX_PAGES and MAX_CONCURRENCY, since they come from
+    request arguments and every page is a paid SerpAPI call.
+
+    Results are merged in page order. Once a page comes back short or empty
+    there is nothing after it, so no further pages are requested and any
+    later pages already fetched are discarded. If a page before that fails
+    (after its retries), no further pages are requested and SearchError is
+    raised once the ones in flight finish, rather than returning a silently
+    truncated list.
+    """
+    pages = max(1, min(int(pages), MAX_PAGES))
+    concurrency = max(1, min(int(concurrency), pages, MAX_CONCURRENCY))
+
+    page_results = {}
+    last_page = pages - 1  # Lowered as soon as a short page is seen
+    next_page = 0
+    in_flight = {}
+    failures = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while in_flight or (next_page <= last_page and not failures):
+            while next_page <= last_page and not failures and len(in_flight) < concurrency:
+                future = pool.submit(carry(fetch_page), user_location, start_date, end_date, next_page)
+                in_flight[future] = next_page
+                next_page += 1
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    page_results[page] = future.result()
+                except SearchError as e:
+                    failures[page] = e
+                    continue
+                if len(page_results[page]) < PAGE_SIZE:
+                    last_page = min(last_page, page)
+
+            # Pages past a short page will be dropped anyway
+            for future, page in list(in_flight.items()):
+                if page > last_page and future.cancel():
+                    del in_flight[future]
+
+    failed = [page for page in sorted(failures) if page <= last_page]
+    if failed:
+        raise SearchError(f"Events search failed for {user_location}: {failures[failed[0]]}")
+
+    events_results = []
+    for page in range(last_page + 1):
+        events_results.extend(page_results.get(page, []))
+    return events_results
@@ -0,0 +1,142 @@
+"""Parsing of Google Events free-text times into start/end datetimes."""
+import re
+from datetime import datetime, timedelta, time as dtime
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+DATE_RE = re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2})\b")
+TIME_RE = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\b")
+WEEKDAY_RE = re.compile(r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b,?")
+RANGE_RE = re.compile(r"\s*(?:–|—|-|\bto\b|\buntil\b)\s*")
+PAST_GRACE = timedelta(days=60)  # Dates further back than this are taken to be next year
+DEFAULT_DURATION = timedelta(hours=2)
+
+
+def _infer_year(month, day, reference):
+    try:
+        candidate = datetime(reference.year, month, day)
+    except ValueError:  # Feb 29 in a non-leap year
+        candidate = datetime(reference.year + 1, 3, 1)
+    if candidate < reference - PAST_GRACE:
+        candidate = candidate.replace(year=candidate.year + 1)
+    return candidate.date()
+
+
+def _parse_part(text, reference):
+    """Returns (date or None, (hour, minute, meridiem or None) or None) for one side of a range."""
+    text = text.lower().replace("noon", "12 pm").replace("midnight", "12 am")
+    day = None
+    match = DATE_RE.search(text)
+    if match:
+        day = _infer_year(MONTHS[match.group(1)], int(match.group(2)), reference)
+        text = text[: match.start()] + " " + text[match.end():]
+    elif "today" in text:
+        day = reference.date()
+    elif "tomorrow" in text:
+        day = reference.date() + timedelta(days=1)
+    text = WEEKDAY_RE.sub(" ", text)
+
+    clock = None
+    match = TIME_RE.search(text)
+    if match and int(match.group(1)) <= 24:
+        clock = (int(match.group(1)), int(match.group(2) or 0), match.group(3))
+    return day, clock
+
+
+def _to_time(clock, meridiem):
+    hour, minute, _ = clock
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+    return dtime(hour % 24, minute)
+
+
+def parse_event_time(date_block, reference=None):
+    """Parses an event's `date` block into (start, end) datetimes.
+
+    Handles single times ("Sun, Feb 23, 7 PM"), ranges sharing a meridiem
+    ("Sun, Feb 23, 4 – 8 PM"), overnight and multi-day ranges
+    ("Fri, Mar 14, 7 PM – Sat, Mar 15, 2 AM", "Mar 14 – 16") and all-day
+    entries. `end` is None when the event gives no end. Returns (None, None)
+    when no date can be found.
+    """
+    reference = reference or datetime.now()
+    date_block = date_block or {}
+    when = date_block.get("when") or ""
+    parts = RANGE_RE.split(when, maxsplit=1)
+    left_day, left_clock = _parse_part(parts[0], reference)
+    right_day, right_clock = _parse_part(parts[1], reference) if len(parts) > 1 else (None, None)
+
+    if left_day is None and date_block.get("start_date"):
+        left_day, _ = _parse_part(date_block["start_date"], reference)
+    if left_day is None:
+        return None, None
+
+    # "Mar 14 – 16": a bare number after a dated start is a day, not a time
+    if right_day is None and right_clock and not right_clock[2] and ":" not in parts[1] and not left_clock:
+        try:
+            right_day = left_day.replace(day=right_clock[0])
+            right_clock = None
+        except ValueError:
+            pass
+    if right_day is not None and right_day < left_day:
+        right_day = right_day.replace(year=right_day.year + 1)
+
+    if left_clock is None:
+        # All-day or date-only entry: cover the whole day(s)
+        start = datetime.combine(left_day, dtime.min)
+        last_day = right_day or left_day
+        end = datetime.combine(last_day, dtime(23, 59)) if right_clock is None else None
+        if right_clock is not None:
+            end = datetime.combine(last_day, _to_time(right_clock, right_clock[2]))
+        return start, end
+
+    left_meridiem = left_clock[2]
+    right_meridiem = right_clock[2] if right_clock else None
+    if left_meridiem is None and right_meridiem:
+        # "4 – 8 PM" shares the meridiem, unless that would put the start after the end ("11 – 2 PM")
+        left_meridiem = right_meridiem
+        if right_meridiem == "pm" and left_clock[0] != 12 and right_clock[0] != 12 and left_clock[0] > right_clock[0]:
+            left_meridiem = "am"
+    start = datetime.combine(left_day, _to_time(left_clock, left_meridiem))
+
+    if right_clock is None:
+        end = datetime.combine(right_day, dtime(23, 59)) if right_day else None
+        return start, end
+
+    end = datetime.combine(right_day or left_day, _to_time(right_clock, right_meridiem or left_meridiem))
+    if end <= start and right_day is None:
+        end += timedelta(days=1)  # Runs past midnight
+    return start, end
+
+
+def annotate_event_times(events, reference=None):
+    """Stores parsed `start_datetime`/`end_datetime` (ISO strings or None) on each event in place."""
+    for event in events:
+        if "start_datetime" in event:
+            continue
+        start, end = parse_event_time(event.get("date"), reference)
+        event["start_datetime"] = start.isoformat() if start else None
+        event["end_datetime"] = end.isoformat() if end else None
+    return events
+
+
+def filter_by_window(events, window_start, window_end):
+    """Keeps events overlapping [window_start, window_end]; events with unknown times are kept."""
+    kept = []
+    for event in events:
+        if not event.get("start_datetime"):
+            kept.append(event)
+            continue
+        start = datetime.fromisoformat(event["start_datetime"])
+        end = (
+            datetime.fromisoformat(event["end_datetime"])
+            if event.get("end_datetime")
+            else start + DEFAULT_DURATION
+        )
+        if start <= window_end and end >= window_start:
+            kept.append(event)
+    return kept
@@ -1,42 +1,75 @@
 import os
-from flask import Flask, jsonify, request
-from serpapi import GoogleSearch
+from flask import Blueprint, Flask, Response, g, jsonify, request, stream_with_context
+from werkzeug.datastructures import MultiDict
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-import geocoder  
 from flask_cors import CORS
-import time
-import json
-import google.generativeai as genai
-from datetime import datetime as dt
+import threading
 from datetime import timedelta
 import datetime
-<<<<<<< HEAD
-import re
-
-
-=======
 import sqlite3
-import shutil
-import pandas as pd
 import re
->>>>>>> 8067be8fe7f21254b0f5698b85d4a77a46e993a7
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
-
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
-
+from event_search import fetch_event_pages, DEFAULT_PAGES, DEFAULT_CONCURRENCY, SearchError
+from search_cache import search_cache
+from geocache import geocode_cache, MISS
+from geocoding import geocode_address, geocode_events, GEOCODE_WORKERS
+from categorize import categorize
+from projection import project_events, compact_json
+from planner import plan_itinerary, narrate_itinerary, parse_start, parse_duration, parse_budget
+from event_time import annotate_event_times, filter_by_window
+from jobs import job_manager
+from llm import generate_json, gemini_model, warm_models, llm_stats, LLMOutputError, SchedulerBusy, ITINERARY_SCHEMA, PREFERENCES_SCHEMA
+from llm_scheduler import gemini_scheduler
+from metrics import count_cache, exposition, finish_request, span, start_request
+from itinerary_stream import stream_itinerary, stream_llm_itinerary
+from spatial import events_index
+from store import session_store, DEFAULT_SESSION
+from corpus import event_corpus, named_window
+from browsing_history import history_profile
+from ranking import build_profile, rank_events, TOP_K
+from prefetch import prefetcher, PREFETCH_INTERVAL, PREFETCH_SESSION
+from client_location import resolve_client_location, location_label, location_latlng, parse_coordinates
+
+# Heavy clients (Gemini, SerpAPI, geocoders) are imported and built on first use, not at import
+routes = Blueprint("eventopia", __name__)
+
+
+def create_app():
+    """Builds the Flask app; `flask --app functions run` and WSGI servers call this."""
+    load_dotenv()
+    app = Flask(__name__)
+    proxy_hops = int(os.getenv("PROXY_HOPS", "0"))
+    if proxy_hops:
+        # Behind a reverse proxy, request.remote_addr becomes the client's address from X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+    CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}}, expose_headers=["X-Event-Set-Id"])
+    app.register_blueprint(routes)
+    if os.getenv("GEMINI_WARM_MODELS"):
+        # Opt-in so plain cold starts still skip the SDK import
+        threading.Thread(target=warm_models, daemon=True).start()
+    if PREFETCH_INTERVAL > 0:
+        prefetcher().start(build_warm_set, PREFETCH_INTERVAL)
+    return app
+
+
+@routes.before_app_request
+def start_request_metrics():
+    g.request_metrics = start_request()
+
+@routes.after_app_request
+def finish_request_metrics(response):
+    if "request_metrics" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        finish_request(g.pop("request_metrics"), route, request.method, request.path, response.status_code)
+    return response
 
-load_dotenv()
-api_key = os.environ["API_KEY"]
-genai.configure(api_key=api_key)
-
-gemini_client = genai.GenerativeModel(
-    model_name="gemini-1.5-flash",
-    system_instruction="You are a local travel planner who will create an itenary based on a list of events that are happening around and your own knowledge of things to do",
-)
 
 def gll(address):
+    cached = geocode_cache().get("google_maps", address)
+    count_cache("geocode", cached is not MISS)
+    if cached is not MISS:
+        return cached
+
     params = {
         "engine": "google_maps",
         "type": "search",
@@ -45,249 +78,378 @@ def gll(address):
         "api_key": os.getenv("SERPAPI_TOKEN") # https://docs.python.org/3/library/os.html#os.getenv
     }
     
+    from serpapi import GoogleSearch
+
     search = GoogleSearch(params)
-    results = search.get_dict()
-    print(results.keys())
+    with span("geocode_attempt"):
+        results = search.get_dict()
+    if "place_results" not in results:
+        geocode_cache().put("google_maps", address, None, None)
+        return None, None
     coordinates = results["place_results"]["gps_coordinates"]
     lat = coordinates['latitude']
     long = coordinates['longitude']
 
+    geocode_cache().put("google_maps", address, lat, long)
     return lat,long
     
 
 
 def get_lat_long(address, retries=3):
-    geolocator = Nominatim(user_agent="geocoding_app", timeout=10)
-    for attempt in range(retries):
-        try:
-            location = geolocator.geocode(address)
-            if location:
-                return location.latitude, location.longitude
-        except GeocoderTimedOut:
-            print(
-                f"Geocoder timed out for '{address}', retrying ({attempt+1}/{retries})..."
-            )
-        time.sleep(2)  # Delay between retries to avoid rate limits
-    return None, None
-
-@app.route('/get-last-coordinates', methods=['GET'])
-def get_last_coordinates():
-    try:
-        with open("json_output/last_coordinates.json", "r") as f:
-            data = json.load(f)
-            return jsonify(data)
-    except FileNotFoundError:
-        return jsonify({"error": "No cached coordinates found"}), 404
-    
-
-@app.route('/get-events', methods=['GET'])
-def get_events():
-    user_location = request.args.get("address", "current")  
-    start_date = request.args.get("start_date", datetime.date.today().strftime("%B %d %Y"))
-    end_date = request.args.get("end_date", datetime.date.today().strftime("%B %d %Y"))
-    latitude=request.args.get("lat", None)
-    longitude=request.args.get("long", None)
-
-    if user_location == "current":
-        g = geocoder.ip("me")
-        user_location = (
-            g.city + ", " + g.state if g.city and g.state else "USA"
-        )  
-
-    print(f"Detected location: {user_location}")
-
-    all_results = {"events_results": []}
+    return geocode_address(address, retries=retries)
+
+
+def resolve_start_location(current_location, events):
+    """(lat, lon) for the itinerary start: coordinates, an address, or the centre of the events."""
+    if isinstance(current_location, (list, tuple)) and len(current_location) == 2:
+        return tuple(current_location)
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*", str(current_location))
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    lat, lon = get_lat_long(current_location) if current_location else (None, None)
+    if lat is not None and lon is not None:
+        return lat, lon
+    located = [e for e in events if e.get("latitude") is not None and e.get("longitude") is not None]
+    if not located:
+        return 0.0, 0.0
+    return (
+        sum(e["latitude"] for e in located) / len(located),
+        sum(e["longitude"] for e in located) / len(located),
+    )
 
-    for i in range(2):
-        params = {
-            "engine": "google_events",
-            "q": f"Events in {user_location} between {start_date} to {end_date}",
-            "hl": "en",
-            "gl": "us",
-            "api_key": os.environ["SEARCH_API_KEY"],
-            "start": str(i * 10),
-        }
 
-        search = GoogleSearch(params)
-        results = search.get_dict()
+def current_session():
+    """Session the request belongs to: the X-Session-Id header or session_id parameter."""
+    return request.headers.get("X-Session-Id") or request.args.get("session_id") or DEFAULT_SESSION
 
-        if "events_results" in results:
-            all_results["events_results"].extend(results["events_results"])
 
-    events_results = all_results.get("events_results", [])
+def load_event_set(session, set_id=None):
+    """Returns (set id, events) for an explicit event set id or the session's latest set."""
+    if set_id:
+        return set_id, session_store().get("events", set_id)
+    return session_store().latest(session, "events")
 
-    for event in events_results:
-        original_address = ", ".join(event["address"])  
-        street_address = event["address"][0]  
-        city_state = event["address"][-1]  
 
-        possible_addresses = [
-            original_address,
-            street_address + ", " + city_state,
-            city_state,
-        ]
+def search_events(user_location, args, start_date=None, end_date=None):
+    """Runs the paged events search, reading `pages`/`concurrency` overrides from the request args."""
+    today = datetime.date.today().strftime("%B %d %Y")
+    return fetch_event_pages(
+        user_location,
+        start_date or args.get("start_date", today),
+        end_date or args.get("end_date", today),
+        pages=args.get("pages", DEFAULT_PAGES, type=int),
+        concurrency=args.get("concurrency", DEFAULT_CONCURRENCY, type=int),
+    )
 
-        lat, lon = None, None
-        for addr in possible_addresses:
-            lat, lon = get_lat_long(addr)
-            if lat and lon:
-                break  
+@routes.route('/search-cache-stats', methods=['GET'])
+def get_search_cache_stats():
+    return jsonify(search_cache.stats())
 
-        event["latitude"] = lat
-        event["longitude"] = lon
+@routes.route('/llm-stats', methods=['GET'])
+def get_llm_stats():
+    """Per call site: Gemini calls, parse/validation failures, local repairs and retries."""
+    return jsonify(llm_stats())
 
-        print(f"Processed: {event['title']} -> ({lat}, {lon})")
+@routes.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape target: stage and request latency histograms, token and cache counters."""
+    return Response(exposition(), mimetype="text/plain; version=0.0.4")
 
-        time.sleep(1)  
+@routes.route('/prefetch-stats', methods=['GET'])
+def get_prefetch_stats():
+    """Warm event sets, today's prefetch page spend and the current hot keys."""
+    return jsonify(prefetcher().stats())
 
-    # 🚀 Save raw event results before categorization
-    output_file = "json_output/events_results.json"
-    COORDS_FILE = "json_output/last_coordinates.json"
+@routes.route('/llm-scheduler-stats', methods=['GET'])
+def get_llm_scheduler_stats():
+    """Gemini admission: in-flight calls, queue depths, waits, rejections and quota errors."""
+    return jsonify(gemini_scheduler().stats())
 
-    with open(output_file, "w", encoding="utf-8") as json_file:
-        json.dump(events_results, json_file, indent=4, ensure_ascii=False)
-    
-    with open(COORDS_FILE, "w") as f:
-        json.dump({"latitude": latitude, "longitude": longitude}, f, indent=4)
-
-    print(f"Results saved to {output_file}")
-<<<<<<< HEAD
-=======
-    #final_events=categorize_events()
-    #return jsonify(final_events)
-    return jsonify(events_results)
->>>>>>> 8067be8fe7f21254b0f5698b85d4a77a46e993a7
+def coordinates_error(args):
+    """A 400 response if the request's lat/long are malformed, else None."""
+    try:
+        parse_coordinates(args.get("lat"), args.get("long"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return None
 
-    # 🚀 Call categorize_events() and get the updated JSON with categories
-    categorized_events = categorize_events()
 
-    # 🚀 Ensure it's a valid dictionary before saving
-    if isinstance(categorized_events, dict):  
-        with open(output_file, "w", encoding="utf-8") as json_file:
-            json.dump(categorized_events, json_file, indent=4, ensure_ascii=False)
+def search_failed_response(error):
+    return jsonify({"error": f"The events search failed, try again shortly: {error}"}), 502
 
-    # 🚀 Return Flask Response
-    return jsonify(categorized_events)
 
-#######################################################################################################################
+def busy_response(error):
+    response = jsonify({"error": f"Gemini is at capacity, try again shortly: {error}"})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
 
-def categorize_events(model=genai.GenerativeModel("gemini-1.5-flash")):
-    json_file_path = "json_output/events_results.json"
-
-    # Load JSON file
-    with open(json_file_path, "r", encoding="utf-8") as file:
-        events = json.load(file)
-
-    query = (
-        "Categorize each event in this JSON file into one of the following categories: "
-        "Concerts and live music, theater and performing arts, movie screenings, theme park events, "
-        "sports and fitness, food and drink, social and networking, technology and innovation, "
-        "education and learning, arts and creativity, outdoor activities, family and kids, nightlife and party. "
-        f"The file is {json.dumps(events)} "
-        "Output must be strictly in JSON format. No explanations, no Markdown formatting, no additional text."
-        "Each event must include a new field called 'category' with the assigned category."
-        "ENSURE valid JSON output. If an error occurs, return an empty list."
-        '''
-        [
-        {
-            "title": "Event Title",
-            "date": {
-            "start_date": "MMM DD",
-            "when": "Day, MMM DD, Time"
-            },
-            "address": [
-            "Street Address",
-            "City, State"
-            ],
-            "link": "https://event-url.com",
-            "event_location_map": {
-            "image": "https://maps.google.com/some-image-url",
-            "link": "https://www.google.com/maps/place/data=some-data",
-            "serpapi_link": "https://serpapi.com/search.json?data=some-data"
-            },
-            "description": "Event description goes here...",
-            "ticket_info": [
-            {
-                "source": "Ticket Provider Name",
-                "link": "https://ticket-url.com",
-                "link_type": "more info"
-            }
-            ],
-            "venue": {
-            "name": "Venue Name",
-            "rating": 4.6,
-            "reviews": 1566,
-            "link": "https://google.com/search?q=venue-name"
-            },
-            "thumbnail": "https://image-url.com",
-            "image": "https://image-url.com",
-            "latitude": 35.996653,
-            "longitude": -78.9018053,
-            "category": "Event Category"
-        }
-        ]
-        '''
-        "Ensure the JSON structure follows this exact format with correct key-value pairs. "
-        "DO NOT include any text before or after the JSON. Output must be valid JSON, without Markdown formatting (` ```json ` etc.)."
-    )
+@routes.route('/get-last-coordinates', methods=['GET'])
+def get_last_coordinates():
+    _, data = session_store().latest(current_session(), "coordinates")
+    if data is None:
+        return jsonify({"error": "No cached coordinates found"}), 404
+    return jsonify(data)
 
-    response = model.generate_content(query)
-<<<<<<< HEAD
-=======
-    categorized_events = json.loads(response.text) 
 
->>>>>>> 8067be8fe7f21254b0f5698b85d4a77a46e993a7
+@routes.route('/get-saved-events', methods=['GET'])
+def get_saved_events():
+    set_id, events = load_event_set(current_session(), request.args.get("event_set"))
+    if events is None:
+        return jsonify({"error": "No saved events found"}), 404
+    response = jsonify(events)
+    response.headers["X-Event-Set-Id"] = set_id
+    return response
+    
 
-    # Debugging: Print Raw Response
-    print("Raw Response from Gemini:", response.text)
+@routes.route('/get-events', methods=['GET'])
+def get_events():
+    error = coordinates_error(request.args)
+    if error:
+        return error
+    try:
+        set_id, events = run_events_pipeline(request.args, current_session(), client_ip=request.remote_addr)
+    except SearchError as e:
+        return search_failed_response(e)
+    response = jsonify(events)
+    response.headers["X-Event-Set-Id"] = set_id
+    return response
+
+
+def build_warm_set(location, start_day, end_day):
+    """Prefetcher build step: a live, geocoded and categorized search stored under the prefetch session."""
+    params = MultiDict({
+        "address": location,
+        "start_date": start_day.strftime("%B %d %Y"),
+        "end_date": end_day.strftime("%B %d %Y"),
+        "source": "live",
+        "categorize": "true",
+    })
+    set_id, _ = run_events_pipeline(params, PREFETCH_SESSION)
+    return set_id
+
+
+def run_events_pipeline(args, session, job=None, client_ip=None):
+    """Search, time-parse, geocode and store events for a session; returns (event set id, events).
+
+    `job` (if any) gets stage timings and each event as it is geocoded.
+    An address of "current" is resolved from the `lat`/`long` arguments or
+    `client_ip`, never from the server's own location lookup per request.
+    """
+    stage = job.stage if job is not None else span
+    user_location = args.get("address", "current")  
+    start_date = args.get("start_date", datetime.date.today().strftime("%B %d %Y"))
+    end_date = args.get("end_date", datetime.date.today().strftime("%B %d %Y"))
+    latitude=args.get("lat", None)
+    longitude=args.get("long", None)
 
-    # Check if response is empty
-    if not response or not response.text.strip():
-        print("ERROR: Empty response from Gemini API.")
-        return {}
+    if user_location == "current":
+        with stage("locate"):
+            user_location = location_label(resolve_client_location(client_ip, session, latitude, longitude))
 
-    cleaned_text = response.text.strip()
+    print(f"Detected location: {user_location}")
 
-    # Remove Markdown formatting if present
-    cleaned_text = re.sub(r"```(json)?\n", "", cleaned_text)  # Remove ```json
-    cleaned_text = re.sub(r"\n```", "", cleaned_text)  # Remove closing ```
-    cleaned_text = cleaned_text.replace("'", '"')
-    cleaned_text = re.sub(r",\s*([\]})])", r"\1", cleaned_text)
-    
-    output_file = "json_output/events_results.json"
-    with open(output_file, "w", encoding="utf-8") as json_file:
-<<<<<<< HEAD
-        json.dump(categorized_events, json_file, indent=4, ensure_ascii=False)
+    window_start = parse_start(start_date, "12:00 AM")
+    window_end = parse_start(end_date, "11:59 PM")
+
+    # A prefetched set for exactly this location and range is served as-is
+    if session != PREFETCH_SESSION:
+        prefetcher().record(user_location, window_start.date(), window_end.date())
+    if args.get("source", "auto") == "auto":
+        _, warm_events = prefetcher().lookup(user_location, window_start.date(), window_end.date())
+        if warm_events is not None:
+            with stage("warm"):
+                if job is not None:
+                    for event in warm_events:
+                        job.emit(event)
+                set_id = session_store().put(session, "events", warm_events)
+                session_store().put(session, "coordinates", {"latitude": latitude, "longitude": longitude})
+            print(f"Served warm event set {set_id} for session {session}")
+            return set_id, warm_events
+
+    # A recent search covering this location and these dates is answered from the corpus
+    from_corpus = args.get("source", "auto") != "live" and event_corpus().covers(
+        user_location, window_start, window_end
+    )
+    count_cache("corpus", from_corpus)
+
+    if from_corpus:
+        with stage("corpus"):
+            # Like the live search: everything upcoming that was found for this location
+            events_results = event_corpus().query(
+                window_start=window_start,
+                user_location=user_location,
+                include_undated=True,
+            )
+            if job is not None:
+                for event in events_results:
+                    job.emit(event)
+    else:
+        with stage("search"):
+            events_results = search_events(user_location, args, start_date, end_date)
+            annotate_event_times(events_results)
+
+        # Geocode concurrently behind the shared Nominatim rate limit
+        with stage("geocode"):
+            geocode_events(
+                events_results,
+                workers=args.get("geocode_workers", GEOCODE_WORKERS, type=int),
+                on_event=job.emit if job is not None else None,
+            )
 
+    if args.get("categorize", "false").lower() == "true":
+        with stage("categorize"):
+            events_results = categorize_events(events_results)
+
+    # 🚀 Save under the session; nothing global is overwritten
+    with stage("save"):
+        if from_corpus:
+            event_corpus().append(events_results)  # Only fills in newly learned categories
+        else:
+            event_corpus().record_search(user_location, window_start, window_end, events_results)
+        set_id = session_store().put(session, "events", events_results)
+        session_store().put(session, "coordinates", {"latitude": latitude, "longitude": longitude})
+
+    print(f"Results saved as event set {set_id} for session {session}")
+    return set_id, events_results
+
+
+@routes.route('/jobs/get-events', methods=['POST'])
+def submit_events_job():
+    """Starts /get-events in the background and returns its job id immediately."""
+    params = MultiDict(request.args)
+    params.update(request.get_json(silent=True) or {})
+    error = coordinates_error(params)
+    if error:
+        return error
+    session = current_session()
+    client_ip = request.remote_addr
+    key = ("get-events", session, client_ip) + tuple(sorted(params.items(multi=True)))
+
+    def run(job):
+        set_id, events = run_events_pipeline(params, session, job, client_ip)
+        return {"event_set_id": set_id, "events": events}
+
+    job, created = job_manager.submit(key, run)
+    return jsonify({
+        "job_id": job.id,
+        "coalesced": not created,
+        "status_url": f"/jobs/{job.id}",
+        "stream_url": f"/jobs/{job.id}/stream",
+    }), 202
+
+
+@routes.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job.snapshot(include_result=request.args.get("result", "false").lower() == "true"))
+
+
+@routes.route('/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """Server-sent events: stage updates, each event as soon as it is geocoded, then done/failed."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return sse_response(job.sse())
+
+
+def sse_response(messages):
+    return Response(
+        stream_with_context(messages),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    # # Ensure JSON parsing
-    # try:
-    #     categorized_events = (cleaned_text)
-    # except json.JSONDecodeError:
-    #     print("ERROR: Gemini returned invalid JSON.")
-    #     return {}
+#######################################################################################################################
 
-    # # 🚀 Return Python Dictionary, NOT `jsonify()`
-    # return categorized_events
+def categorize_events(events, model=None):
+    # Only events we have not categorized before go to Gemini, in small concurrent chunks
+    return categorize(events, model or gemini_model("gemini-1.5-flash"))
 
-@app.route('/get-curlocation-events', methods=['GET'])
+@routes.route('/get-curlocation-events', methods=['GET'])
 def get_curlocation_events():
     # Load environment variables from the .env file
     load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), 'eventopia/.env'))
     
-    # Fetch user's location automatically based on IP
-    g = geocoder.ip('me')
-    user_location = f"{g.city}, {g.state}" if g.city and g.state else "USA"  # Fallback to "USA" if location fails
+    # Locate the user from coordinates they sent, else from their IP address
+    error = coordinates_error(request.args)
+    if error:
+        return error
+    with span("locate"):
+        located = resolve_client_location(
+            request.remote_addr, current_session(), request.args.get("lat"), request.args.get("long")
+        )
+    user_location = location_label(located)  # Fallback to "USA" if location fails
     print(f"Detected location: {user_location}")
-=======
-        json.dump(categorized_events, json_file, indent=4, ensure_ascii=False)  # Saves as structured JSON
-    return categorized_events
 
+    today = datetime.date.today().strftime("%B %d %Y")
+    start_day = parse_start(request.args.get("start_date", today), "12:00 AM").date()
+    end_day = parse_start(request.args.get("end_date", today), "11:59 PM").date()
+    prefetcher().record(user_location, start_day, end_day)
+    _, events_results = prefetcher().lookup(user_location, start_day, end_day)
+    if events_results is None:
+        try:
+            events_results = search_events(user_location, request.args)
+        except SearchError as e:
+            return search_failed_response(e)
+    return jsonify(events_results)
+
+
+
+@routes.route('/events-nearby', methods=['GET'])
+def get_events_nearby():
+    latitude = request.args.get("lat", type=float)
+    longitude = request.args.get("long", type=float)
+    radius_km = request.args.get("radius_km", 5, type=float)
+    session = current_session()
 
->>>>>>> 8067be8fe7f21254b0f5698b85d4a77a46e993a7
+    # Default to the coordinates of the session's last /get-events call
+    if latitude is None or longitude is None:
+        _, coords = session_store().latest(session, "coordinates")
+        try:
+            latitude, longitude = float(coords["latitude"]), float(coords["longitude"])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "lat and long parameters are required"}), 400
+
+    set_id, events = load_event_set(session, request.args.get("event_set"))
+    if events is None:
+        return jsonify([])
+    nearby = events_index(set_id, events).within(latitude, longitude, radius_km)
+    return jsonify([dict(event, distance_km=round(distance, 3)) for event, distance in nearby])
+
+
+@routes.route('/corpus-events', methods=['GET'])
+def get_corpus_events():
+    """Compound query over every event seen so far, e.g. ?category=Concerts %26 Live Music&lat=..&long=..&radius_km=5&when=weekend."""
+    latitude = request.args.get("lat", type=float)
+    longitude = request.args.get("long", type=float)
+    radius_km = request.args.get("radius_km", type=float)
+    if radius_km is not None and (latitude is None or longitude is None):
+        return jsonify({"error": "lat and long are required with radius_km"}), 400
+
+    window_start = window_end = None
+    if request.args.get("when"):
+        window_start, window_end = named_window(request.args["when"])
+    elif request.args.get("start_date"):
+        window_start = parse_start(request.args["start_date"], "12:00 AM")
+        window_end = parse_start(request.args.get("end_date", request.args["start_date"]), "11:59 PM")
+
+    events = event_corpus().query(
+        lat=latitude,
+        lon=longitude,
+        radius_km=radius_km,
+        window_start=window_start,
+        window_end=window_end,
+        category=request.args.get("category"),
+        user_location=request.args.get("location"),
+        limit=request.args.get("limit", type=int),
+    )
+    return jsonify(events)
 
 
-@app.route('/get-coordinates', methods=['GET'])
+@routes.route('/get-coordinates', methods=['GET'])
 def get_coordinates():
     address = request.args.get("address")  # Get address from query params
     if not address:
@@ -301,10 +463,10 @@ def get_coordinates():
     return jsonify({"address": address, "latitude": latitude, "longitude": longitude})
 
 
-@app.route('/get-itinerary', methods=['GET'])
+@routes.route('/get-itinerary', methods=['GET'])
 def generate_itenary():
 
-    time = request.args.get("time", "rest of day")
+    trip_time = request.args.get("time", "rest of day")
     start_time = request.args.get("start_time", "09:00 AM")
     current_location = request.args.get("current_location", "current")
     start_date = request.args.get("start_date", "today")
@@ -313,29 +475,73 @@ def generate_itenary():
     use_feature = request.args.get("use_feature", "false").lower() == "true"  # Convert to boolean
     mode_of_transport = request.args.get("mode_of_transport", "public")
     use_data = request.args.get("use_data", "false").lower() == "true"
-    model=genai.GenerativeModel("gemini-1.5-flash")
+    planner = request.args.get("planner", "local")  # "local" solver or "llm"
+    narrate = request.args.get("narrate", "false").lower() == "true"
+    stream = request.args.get("stream", "false").lower() == "true"  # Server-sent features as they are ready
+    session = current_session()
 
     if current_location == "current":
-        g = geocoder.ip("me")
-        current_location = g.latlng if g.latlng else "Unknown Location"
-
-    # Load event data
-    events_file = "json_output/events_results.json"
-    with open(events_file, "r", encoding="utf-8") as file:
-        events = json.load(file)
+        error = coordinates_error(request.args)
+        if error:
+            return error
+        located = resolve_client_location(
+            request.remote_addr, session, request.args.get("lat"), request.args.get("long"), reverse=False
+        )
+        current_location = location_latlng(located) or "Unknown Location"
+
+    # Events of the given event set, or of the session's last search
+    _, events = load_event_set(session, request.args.get("event_set"))
+    if events is None:
+        return jsonify({"error": "Event set not found; call /get-events first"}), 404
+
+    # Drop events outside the requested window before planning or prompting
+    window_start = parse_start(start_date, start_time)
+    window_end = min(
+        parse_start(end_date, "11:59 PM"),
+        window_start + timedelta(minutes=parse_duration(trip_time, window_start)),
+    )
+    events = filter_by_window(annotate_event_times([dict(e) for e in events]), window_start, window_end)
+
+    # Personalization is a local vector profile. Only the top-K ranked events go into the
+    # prompt; the local planner gets them all, as it drops unreachable or unaffordable
+    # events before making its own cut
+    profile = preference_profile(session) if use_feature else None
+    start_location = resolve_start_location(current_location, events)
+    top_k = request.args.get("top_k", None if planner == "local" else TOP_K, type=int)
+    with span("rank"):
+        events = rank_events(events, start_location, profile, parse_budget(cost), top_k)
+
+    if planner == "local":
+        # Deterministic plan; Gemini only adds descriptions and restaurants when asked
+        with span("itinerary_plan"):
+            parsed_itenary = plan_itinerary(
+                events, start_location, trip_time, start_date, start_time, cost, mode_of_transport
+            )
+        if narrate:
+            with span("itinerary_narrate"):
+                parsed_itenary = narrate_itinerary(parsed_itenary, gemini_model("gemini-1.5-flash"))
+        save_itenary(parsed_itenary, session)
+        if stream:
+            return sse_response(stream_itinerary(parsed_itenary))
+        return parsed_itenary
 
     # Load user preferences if applicable
+    # Events are already ranked by preference; the prompt only needs the theme names
     if use_feature:
-        preferences_file = "json_output/user_preference.json"
-        try:
-            with open(preferences_file, "r", encoding="utf-8") as file:
-                features = json.load(file)
-            feature_text = f"User preferences: {json.dumps(features)}"
-        except FileNotFoundError:
+        _, features = session_store().latest(session, "preferences")
+        if features is not None:
+            themes = sorted(features.get("themes", []), key=lambda t: -(t.get("weight") or 0))
+            feature_text = f"User interests: {', '.join(t['theme'] for t in themes[:5])}"
+        else:
             feature_text = "User preferences not available."
     else:
         feature_text = ""
 
+    model = gemini_model("gemini-1.5-flash")
+
+    # Only the fields the planner needs go into the prompt
+    event_rows = project_events(events, label="itinerary")
+
     # Construct the query for Gemini
     query = f"""
     You are a structured travel planner. Create an itinerary based on the given events.
@@ -367,7 +573,7 @@ def generate_itenary():
         "total_estimated_time": 24
     }}
 
-    In addition to the events we upload, include your knowledge of restaurant and public spaces if needed in your output. The events are: {json.dumps(events)}.
+    In addition to the events we upload, include your knowledge of restaurant and public spaces if needed in your output. The events are: {compact_json(event_rows)}.
     "Generate most of the itenary from events which wasy uploaded in the file above."
     
 
@@ -375,7 +581,7 @@ def generate_itenary():
     - Current location: {current_location}
     - Start Date: {start_date}
     - End Date: {end_date}
-    - Total trip time: {time} hours
+    - Total trip time: {trip_time} hours
     - Budget: {cost} dollars
     - Mode of transport: {mode_of_transport}
     - {feature_text}
@@ -387,111 +593,86 @@ def generate_itenary():
     Ensure the response is **strictly valid JSON**, without Markdown, explanations, or extra text.
     """
 
-    response = model.generate_content(query)
-    itenary = response.text  # Get raw Gemini response
+    if stream:
+        # Each Feature goes out as soon as it closes; the full document is saved at the end
+        return sse_response(stream_llm_itinerary(
+            model, query, on_done=lambda itenary: save_itenary(itenary, session)
+        ))
 
-    # Remove Markdown formatting if present
-    itenary = re.sub(r"```(geojson|json)\n", "", itenary)
-    itenary = re.sub(r"\n```", "", itenary)
-
-    # Convert JSON string to Python dictionary
+    # Schema-constrained output, repaired locally before any retry; raw text is never saved
     try:
-        parsed_itenary = json.loads(itenary)
-    except json.JSONDecodeError:
-        print("ERROR: Gemini returned invalid JSON. Saving raw response instead.")
-        parsed_itenary = itenary  # Save as raw text if JSON parsing fails
+        with span("itinerary_llm"):
+            parsed_itenary = generate_json(model, query, "itinerary", ITINERARY_SCHEMA)
+    except SchedulerBusy as e:
+        return busy_response(e)
+    except LLMOutputError as e:
+        return jsonify({"error": f"Gemini did not return a valid itinerary: {e}"}), 502
 
-    # Save cleaned JSON
-    output_file = "json_output/final_itenary.json"
-    with open(output_file, "w", encoding="utf-8") as json_file:
-        json.dump(parsed_itenary, json_file, indent=4, ensure_ascii=False)
+    save_itenary(parsed_itenary, session)
 
     return parsed_itenary
 
-#######################################################################################################################
-
-def user_browser_history():
-    """Fetches browsing history from Google Chrome and saves it as a JSON file."""
-    if os.name == "nt":  # Windows
-        history_db_path = os.path.expanduser(
-            r"~\AppData\Local\Google\Chrome\User Data\Default\History"
-        )
-    elif os.name == "posix":  # Mac/Linux
-        history_db_path = os.path.expanduser(
-            "~/Library/Application Support/Google/Chrome/Default/History"
-        )
-
-    # Create a temporary copy of the history database
-    temp_db_path = "./chrome_history_temp.db"
-    shutil.copy2(history_db_path, temp_db_path)
-
-    # Connect to the copied database
-    conn = sqlite3.connect(temp_db_path)
-    cursor = conn.cursor()
 
-    # Query to fetch browsing history
-    query = """
-    SELECT url, title, visit_count, last_visit_time 
-    FROM urls
-    ORDER BY last_visit_time DESC
-    LIMIT 100;
-    """
-
-    cursor.execute(query)
-    history_data = cursor.fetchall()
-
-    # Convert Chrome's timestamp format to human-readable datetime
-    def convert_chrome_timestamp(timestamp):
-        return dt(1601, 1, 1) + timedelta(microseconds=timestamp)
+def preference_profile(session):
+    """The session's vector profile, built from its preference themes and the history profile if needed."""
+    _, profile = session_store().latest(session, "profile")
+    if profile is None:
+        _, preferences = session_store().latest(session, "preferences")
+        profile = build_profile(preferences, history_profile().compact())
+        if profile is not None:
+            session_store().put(session, "profile", profile)
+    return profile
 
-    df = pd.DataFrame(history_data, columns=["URL", "Title", "Visit Count", "Last Visit Time"])
-    df["Last Visit Time"] = df["Last Visit Time"].apply(convert_chrome_timestamp)
 
-    conn.close()
-
-    # Save history to JSON
-    df.to_json("json_output/chrome_browsing_history.json", orient="records", indent=4)
+def save_itenary(itenary, session=DEFAULT_SESSION):
+    return session_store().put(session, "itinerary", itenary)
 
 #######################################################################################################################
-@app.route('/user_history', methods=['GET'])
-def user_features_browsing_history():
-    """Generates user preferences based on browsing history using Gemini AI."""
-    model=genai.GenerativeModel("gemini-2.0-flash")
-    user_browser_history()
-    history_file = "json_output/chrome_browsing_history.json"
 
-    # Load browsing history
+@routes.route('/user_history', methods=['GET'])
+def user_features_browsing_history():
+    """Folds new Chrome visits into the history profile and derives preference themes from it."""
+    session = current_session()
     try:
-        with open(history_file, "r", encoding="utf-8") as file:
-            history = json.load(file)
-    except FileNotFoundError:
-        print("ERROR: Browsing history file not found.")
+        new_visits = history_profile().ingest()
+    except sqlite3.Error as e:
+        print(f"ERROR: Browsing history not readable: {e}")
         return {}
 
+    # Nothing new since the last profile: keep the themes derived from it
+    _, preferences = session_store().latest(session, "preferences")
+    if new_visits == 0 and preferences is not None:
+        return preferences
+
+    profile = history_profile().compact()
+    if not profile["domains"]:
+        return {}
+    print(f"Browsing history: {new_visits} new visits, {profile['visits']} in profile")
+
     query = f"""
-    Analyze this user's browsing history and identify themes of interest.
-    Return the response strictly as a JSON object without explanations.
+    Analyze this user's browsing profile (most visited domains and page-title terms, with visit counts)
+    and identify themes of interest.
+    Give each theme a weight between 0 and 1 and a few keywords.
 
-    Browsing History:
-    {json.dumps(history, indent=4)}
+    Browsing profile:
+    {compact_json({"domains": profile["domains"], "terms": profile["terms"]})}
     """
 
-    response = model.generate_content(query)
-    profile_features = response.text
-
     try:
-        parsed_features = json.loads(profile_features)
-    except json.JSONDecodeError:
-        print("ERROR: Gemini returned invalid JSON. Saving raw response instead.")
-        parsed_features = profile_features  # Save as raw text if JSON parsing fails
+        parsed_features = generate_json(gemini_model("gemini-2.0-flash"), query, "user_history", PREFERENCES_SCHEMA)
+    except SchedulerBusy as e:
+        return busy_response(e)
+    except LLMOutputError as e:
+        return jsonify({"error": f"Gemini did not return a valid preference profile: {e}"}), 502
 
-    output_file = "json_output/user_preference.json"
-    with open(output_file, "w", encoding="utf-8") as json_file:
-        json.dump(parsed_features, json_file, indent=4, ensure_ascii=False)
+    session_store().put(session, "preferences", parsed_features)
+    ranking_profile = build_profile(parsed_features, profile)
+    if ranking_profile is not None:
+        session_store().put(session, "profile", ranking_profile)
 
     return parsed_features
 
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
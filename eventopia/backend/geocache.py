@@ -0,0 +1,169 @@
+"""Persistent geocoding cache: an in-process LRU in front of a SQLite table."""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "json_output/geocode_cache.db")
+DEFAULT_TTL = 30 * 24 * 3600  # Venues rarely move
+NEGATIVE_TTL = 24 * 3600  # Retry unresolvable addresses daily
+MAX_ENTRIES = 50000
+LRU_SIZE = 2048
+
+MISS = object()  # Sentinel: (None, None) is a valid cached negative result
+
+
+def normalize_address(address):
+    """Normalizes an address so trivially different spellings share a cache key."""
+    address = address.lower().strip()
+    address = re.sub(r"\s*,\s*", ", ", address)
+    address = re.sub(r"\s+", " ", address)
+    return address.strip(", ")
+
+
+class GeocodeCache:
+    """Caches (lat, lon) per provider and normalized address, including misses."""
+
+    def __init__(
+        self,
+        path=CACHE_PATH,
+        ttl=DEFAULT_TTL,
+        negative_ttl=NEGATIVE_TTL,
+        max_entries=MAX_ENTRIES,
+        lru_size=LRU_SIZE,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocodes (
+                key TEXT PRIMARY KEY,
+                latitude REAL,
+                longitude REAL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS geocodes_accessed ON geocodes (accessed_at)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS variant_wins (
+                key TEXT PRIMARY KEY,
+                variant INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(provider, address):
+        return f"{provider}:{normalize_address(address)}"
+
+    def _remember(self, key, value, expires_at):
+        self._lru[key] = (value, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, provider, address):
+        """Returns the cached (lat, lon) for an address, or MISS."""
+        key = self._key(provider, address)
+        now = time.time()
+        with self._lock:
+            if key in self._lru:
+                value, expires_at = self._lru[key]
+                if expires_at > now:
+                    self._lru.move_to_end(key)
+                    return value
+                del self._lru[key]
+
+            row = self._conn.execute(
+                "SELECT latitude, longitude, expires_at FROM geocodes WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return MISS
+            if row[2] <= now:
+                self._conn.execute("DELETE FROM geocodes WHERE key = ?", (key,))
+                self._conn.commit()
+                return MISS
+
+            self._conn.execute(
+                "UPDATE geocodes SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            value = (row[0], row[1])
+            self._remember(key, value, row[2])
+            return value
+
+    def put(self, provider, address, lat, lon):
+        """Stores a lookup result; pass lat=lon=None to record that nothing was found."""
+        key = self._key(provider, address)
+        now = time.time()
+        expires_at = now + (self.ttl if lat is not None else self.negative_ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lon, expires_at, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+            self._remember(key, (lat, lon), expires_at)
+
+    def get_variant(self, venue):
+        """Returns the index of the address variant that last resolved this venue, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT variant FROM variant_wins WHERE key = ?",
+                (normalize_address(venue),),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_variant(self, venue, variant):
+        """Records which address variant resolved a venue."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO variant_wins VALUES (?, ?, ?)",
+                (normalize_address(venue), variant, time.time()),
+            )
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM geocodes WHERE expires_at <= ?", (now,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                """
+                DELETE FROM geocodes WHERE key IN (
+                    SELECT key FROM geocodes ORDER BY accessed_at LIMIT ?
+                )
+                """,
+                (count - self.max_entries,),
+            )
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def geocode_cache():
+    """Returns the process-wide cache, opening it on first use."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = GeocodeCache()
+        return _shared_cache
@@ -0,0 +1,364 @@
+"""Rate-limited, concurrent event geocoding backed by the shared geocode cache."""
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from geocache import geocode_cache, MISS
+from metrics import carry, count_cache, span
+from venues import apply_venues, register_venues
+
+NOMINATIM_RPS = float(os.getenv("NOMINATIM_RPS", "1"))  # Nominatim usage policy: 1 req/s
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")  # Self-hosted or stub servers
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME", "https")
+GEOCODE_WORKERS = 4
+MAX_GEOCODE_WORKERS = 8  # Upper bound on the geocode_workers request argument
+HEDGE_DELAY = 1.0  # Seconds to wait on a sent variant before also trying the next one
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 8.0
+
+variant_pool = ThreadPoolExecutor(max_workers=GEOCODE_WORKERS * 3)
+_geolocator = None
+_geolocator_lock = threading.Lock()
+
+
+def nominatim():
+    """The shared Nominatim client, created on first use so importing this module stays cheap."""
+    global _geolocator
+    with _geolocator_lock:
+        if _geolocator is None:
+            from geopy.geocoders import Nominatim
+
+            _geolocator = Nominatim(
+                user_agent="geocoding_app", timeout=10, domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME
+            )
+        return _geolocator
+
+
+class TokenBucket:
+    """Blocking token bucket shared by every thread calling a provider."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, cancel=None):
+        """Takes a token, blocking until one is free.
+
+        Returns False without taking one if the optional `cancel` event is
+        set before then.
+        """
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    return False
+                with self._lock:
+                    now = time.monotonic()
+                    self._tokens = min(
+                        self.capacity, self._tokens + (now - self._updated) * self.rate
+                    )
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+                if cancel is not None:
+                    cancel.wait(wait)
+                else:
+                    time.sleep(wait)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def queued(self):
+        """Number of callers currently waiting for a token."""
+        with self._lock:
+            return self._waiting
+
+
+nominatim_limiter = TokenBucket(NOMINATIM_RPS)
+
+
+class GeocodeStats:
+    """Per-batch counters: network requests issued, retries, failures and wall time."""
+
+    def __init__(self):
+        self.issued = 0
+        self.retried = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.venue_hits = 0
+        self.hedged = 0
+        self.shared = 0
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            "issued": self.issued,
+            "retried": self.retried,
+            "failed": self.failed,
+            "cache_hits": self.cache_hits,
+            "venue_hits": self.venue_hits,
+            "hedged": self.hedged,
+            "shared": self.shared,
+            "wall_time": round(self.wall_time, 3),
+        }
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+_in_flight = {}  # address -> (Future of (lat, lon), or None if its owner was cancelled; sent event)
+_in_flight_lock = threading.Lock()
+
+
+def geocode_address(address, retries=3, stats=None, cancel=None, on_sent=None):
+    """Resolves an address through the cache, then rate-limited Nominatim; returns (lat, lon).
+
+    Concurrent lookups of the same address share one request. Setting the
+    optional `cancel` event abandons the lookup before its next network
+    request (or while it waits for a token); `on_sent()` is called once the
+    request is on its way.
+    """
+    stats = stats or GeocodeStats()
+    while True:
+        cached = geocode_cache().get("nominatim", address)
+        count_cache("geocode", cached is not MISS)
+        if cached is not MISS:
+            stats.add(cache_hits=1)
+            return cached
+        if cancel is not None and cancel.is_set():
+            return None, None
+
+        with _in_flight_lock:
+            shared = _in_flight.get(address)
+            if shared is None:
+                result, sent = _in_flight[address] = (Future(), threading.Event())
+        if shared is not None:
+            result, sent = shared
+            stats.add(shared=1)
+            sent.wait()
+            if on_sent is not None:
+                on_sent()
+            if result.result() is not None:
+                return result.result()
+            continue  # Its owner was cancelled before asking; try again ourselves
+
+        def mark_sent():
+            sent.set()
+            if on_sent is not None:
+                on_sent()
+
+        try:
+            location = _lookup(address, retries, stats, cancel, mark_sent)
+            result.set_result(location)
+        except BaseException as e:
+            result.set_exception(e)
+            raise
+        finally:
+            sent.set()
+            with _in_flight_lock:
+                _in_flight.pop(address, None)
+        return (None, None) if location is None else location
+
+
+def _lookup(address, retries, stats, cancel, on_sent):
+    """Network half of geocode_address; None if cancelled before any answer."""
+    from geopy.exc import GeocoderServiceError
+
+    for attempt in range(retries):
+        with span("geocode_wait"):
+            acquired = nominatim_limiter.acquire(cancel)
+        if not acquired:
+            return None
+        on_sent()
+        stats.add(issued=1)
+        try:
+            with span("geocode_attempt"):
+                location = nominatim().geocode(address)
+        except GeocoderServiceError as e:  # Timeouts, rate limiting and 5xx answers
+            print(
+                f"Geocoder failed for '{address}' ({e}), retrying ({attempt+1}/{retries})..."
+            )
+            if attempt + 1 < retries:
+                stats.add(retried=1)
+                with span("geocode_wait"):
+                    time.sleep(backoff_delay(attempt))
+                if cancel is not None and cancel.is_set():
+                    return None
+            continue
+
+        if location:
+            geocode_cache().put("nominatim", address, location.latitude, location.longitude)
+            return location.latitude, location.longitude
+        geocode_cache().put("nominatim", address, None, None)  # Not found, don't retry
+        return None, None
+
+    stats.add(failed=1)
+    return None, None
+
+
+def address_variants(event):
+    """Address strings to try for an event, most precise first."""
+    address = event.get("address")
+    if not isinstance(address, list) or not address:
+        return []
+    street_address = address[0]
+    city_state = address[-1] if len(address) > 1 else ""
+    variants = [
+        ", ".join(address),  # Full address
+        f"{street_address}, {city_state}".strip(", "),  # Street + City/State
+        city_state,  # City and state only
+    ]
+    return [v for i, v in enumerate(variants) if v and v not in variants[:i]]
+
+
+def _decided(futures, total):
+    """Index of the most precise successful variant once no more precise one is pending.
+
+    Returns -1 when every variant failed and None while the answer is still open.
+    """
+    for index, future in enumerate(futures):
+        if not future.done():
+            return None
+        lat, lon = future.result()
+        if lat is not None and lon is not None:
+            return index
+    return -1 if len(futures) == total else None
+
+
+def geocode_event(event, stats, hedge_delay=HEDGE_DELAY):
+    """Resolves an event's address variants with hedged requests.
+
+    The full address goes out first; each less precise variant is launched
+    when the previous one fails, or has not answered within `hedge_delay` of
+    its request being sent while nobody else is waiting on the limiter (a
+    hedge would only queue behind them). The most precise success wins, the
+    rest are cancelled, and the winning variant is remembered so the next
+    lookup for this venue starts with it.
+
+    Returns (lat, lon, precise); `precise` is False when only the city-level
+    fallback resolved, so the point is not the venue's own location.
+    """
+    variants = address_variants(event)
+    if not variants:
+        return None, None, False
+    venue = variants[0]
+
+    winner = geocode_cache().get_variant(venue)
+    if winner is not None and winner < len(variants):
+        lat, lon = geocode_address(variants[winner], stats=stats)
+        if lat is not None and lon is not None:
+            return lat, lon, _precise(event, variants[winner])
+
+    cancel = threading.Event()
+    futures = []
+    sent_at = {}
+
+    def launch():
+        index = len(futures)
+        futures.append(
+            variant_pool.submit(
+                carry(geocode_address),
+                variants[index],
+                stats=stats,
+                cancel=cancel,
+                on_sent=lambda: sent_at.setdefault(index, time.monotonic()),
+            )
+        )
+
+    launch()
+    try:
+        while (index := _decided(futures, len(variants))) is None:
+            pending = [f for f in futures if not f.done()]
+            if not pending:
+                launch()  # Everything tried so far failed
+                continue
+            more = len(futures) < len(variants)
+            sent = sent_at.get(len(futures) - 1)
+            timeout = None
+            if more:
+                # The hedge clock runs from when the latest variant was sent, not while it queued
+                due = hedge_delay if sent is None else sent + hedge_delay - time.monotonic()
+                timeout = hedge_delay if nominatim_limiter.queued() else max(0.0, due)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if (
+                more
+                and not done
+                and sent is not None
+                and time.monotonic() >= sent + hedge_delay
+                and not nominatim_limiter.queued()
+            ):
+                stats.add(hedged=1)
+                launch()
+    finally:
+        cancel.set()
+        for future in futures:
+            future.cancel()
+
+    if index < 0:
+        return None, None, False
+    geocode_cache().put_variant(venue, index)
+    lat, lon = futures[index].result()
+    return lat, lon, _precise(event, variants[index])
+
+
+def _precise(event, variant):
+    """Whether `variant` names more than the city ("City, State" alone is a centroid)."""
+    address = event.get("address") or []
+    return not (len(address) > 1 and variant == address[-1])
+
+
+def geocode_events(events, workers=GEOCODE_WORKERS, on_event=None):
+    """Geocodes events concurrently behind the shared limiter, setting latitude/longitude in place.
+
+    Events whose place id is in the venue registry take their coordinates
+    from it; address geocoding is only the fallback for the rest, whose
+    results are then registered unless only the city-level fallback resolved. Events that already carry coordinates are
+    left alone. If given, `on_event(event)` is called for every event as soon
+    as its coordinates are settled (in completion order). Returns the batch
+    stats as a dict. `workers` is clamped to MAX_GEOCODE_WORKERS.
+    """
+    workers = max(1, min(int(workers), MAX_GEOCODE_WORKERS))
+    stats = GeocodeStats()
+    started = time.monotonic()
+    stats.add(venue_hits=apply_venues(events))
+    pending = [e for e in events if e.get("latitude") is None]
+    if on_event is not None:
+        for event in events:
+            if event.get("latitude") is not None:
+                on_event(event)
+
+    precise = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(carry(geocode_event), event, stats): event for event in pending}
+        for future in as_completed(futures):
+            event = futures[future]
+            lat, lon, exact = future.result()
+            event["latitude"] = lat
+            event["longitude"] = lon
+            if exact:
+                precise.append(event)
+            print(f"Processed: {event.get('title')} -> ({lat}, {lon})")
+            if on_event is not None:
+                on_event(event)
+    register_venues(precise)
+
+    stats.wall_time = time.monotonic() - started
+    print(f"Geocoding stats: {stats.as_dict()}")
+    return stats.as_dict()
@@ -0,0 +1,148 @@
+"""Incremental parsing of a streamed GeoJSON itinerary into completed features."""
+import json
+import re
+
+from jobs import sse_message
+from llm import stream_text, parse_json, validate, record_parse_failure, ITINERARY_SCHEMA
+
+
+class FeatureStreamParser:
+    """Scans JSON text chunk by chunk and returns each `features[]` item as soon as it closes.
+
+    Only tracks string/escape state and the container stack, so each chunk is
+    scanned once; a feature is decoded with json.loads only when its closing
+    brace arrives. Anything outside the top-level object (such as Markdown
+    fences) is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack = []  # (opening char, key it was opened under)
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._feature_start = None
+
+    def feed(self, chunk):
+        """Adds a chunk of model output; returns the list of features completed by it."""
+        self.text += chunk
+        features = []
+        text = self.text
+        while self._pos < len(text):
+            i = self._pos
+            ch = text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start:i]
+                continue
+
+            if not self._stack and ch != "{":
+                continue  # Markdown fences or stray text around the document
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch in "{[":
+                key = self._last_string if self._after_colon(i) else None
+                if ch == "{" and self._in_features():
+                    self._feature_start = i
+                self._stack.append((ch, key))
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if ch == "}" and self._feature_start is not None and self._in_features():
+                    try:
+                        features.append(json.loads(text[self._feature_start: i + 1]))
+                    except json.JSONDecodeError as e:
+                        print(f"ERROR: Skipping malformed itinerary feature: {e}")
+                    self._feature_start = None
+        return features
+
+    def _after_colon(self, index):
+        j = index - 1
+        while j >= 0 and self.text[j].isspace():
+            j -= 1
+        return j >= 0 and self.text[j] == ":"
+
+    def _in_features(self):
+        return len(self._stack) == 2 and self._stack[0][0] == "{" and self._stack[1] == ("[", "features")
+
+    def document(self, features):
+        """The whole itinerary once the stream has ended.
+
+        Falls back to the streamed features (with the cost summed locally and
+        the time taken from the last stop) when the full text is not a valid
+        itinerary, e.g. if the model's closing totals are malformed.
+        """
+        try:
+            parsed, _ = parse_json(self.text)
+            if not validate(parsed, ITINERARY_SCHEMA):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+        print("ERROR: Streamed itinerary is not a valid itinerary. Keeping the completed features.")
+        record_parse_failure("itinerary_stream")
+        costs = [(f.get("properties") or {}).get("cost") for f in features]
+        return {
+            "type": "FeatureCollection",
+            "features": features,
+            "total_estimated_cost": round(sum(c for c in costs if isinstance(c, (int, float)))),
+            "total_estimated_time": max((_hours(f) for f in features), default=0),
+        }
+
+
+def _hours(feature):
+    """Hours in a feature's "time_since_start" ("2 hours 30 minutes"); 0 if unreadable."""
+    text = str((feature.get("properties") or {}).get("time_since_start", ""))
+    hours = re.search(r"(\d+(?:\.\d+)?)\s*h", text)
+    minutes = re.search(r"(\d+(?:\.\d+)?)\s*m", text)
+    total = (float(hours.group(1)) if hours else 0) + (float(minutes.group(1)) / 60 if minutes else 0)
+    return round(total, 1)
+
+def stream_llm_itinerary(model, query, on_done=None):
+    """Yields server-sent events for an itinerary generated by Gemini in streaming mode.
+
+    Each `feature` event carries one GeoJSON Feature as soon as it is complete;
+    the final `done` event carries the totals. `on_done` receives the full
+    itinerary (e.g. to persist it) only if the stream finished and produced at
+    least one feature; otherwise the stream ends with an `error` event and
+    nothing is passed on.
+    """
+    parser = FeatureStreamParser()
+    features = []
+    try:
+        for text in stream_text(model, query, "itinerary_stream", ITINERARY_SCHEMA):
+            for feature in parser.feed(text):
+                features.append(feature)
+                yield sse_message("feature", feature)
+    except Exception as e:
+        print(f"ERROR: Itinerary stream failed: {e}")
+        yield sse_message("error", {"error": str(e), "features_sent": len(features)})
+        return
+    if not features:
+        print("ERROR: Itinerary stream produced no stops.")
+        yield sse_message("error", {"error": "The generated itinerary had no stops", "features_sent": 0})
+        return
+
+    itinerary = parser.document(features)
+    if on_done is not None:
+        on_done(itinerary)
+    yield sse_message("done", _totals(itinerary))
+
+
+def stream_itinerary(itinerary):
+    """Yields server-sent events for an already planned itinerary, in the same format."""
+    for feature in itinerary.get("features", []):
+        yield sse_message("feature", feature)
+    yield sse_message("done", _totals(itinerary))
+
+
+def _totals(itinerary):
+    return {key: value for key, value in itinerary.items() if key not in ("type", "features")}
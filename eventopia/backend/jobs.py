@@ -0,0 +1,161 @@
+"""Background jobs with per-stage timings and incremental result streaming."""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import span
+
+JOB_WORKERS = 4
+JOB_RESULT_TTL = 60  # Seconds a finished job is reused for identical parameters
+JOB_RETENTION = 15 * 60  # Seconds a finished job stays queryable
+
+
+class Job:
+    """State of one pipeline run: status, stage timings and the events emitted so far."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.stages = {}
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    @contextmanager
+    def stage(self, name):
+        """Records the wall time of a pipeline stage (also into the stage metrics) and announces it to streams."""
+        with self._cond:
+            self.stages[name] = {"status": "running", "seconds": None}
+            self._cond.notify_all()
+        started = time.monotonic()
+        try:
+            with span(name):
+                yield
+        finally:
+            with self._cond:
+                self.stages[name] = {
+                    "status": "done",
+                    "seconds": round(time.monotonic() - started, 3),
+                }
+                self._cond.notify_all()
+
+    def emit(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def _finish(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def snapshot(self, include_result=False):
+        with self._cond:
+            data = {
+                "job_id": self.id,
+                "status": self.status,
+                "stages": dict(self.stages),
+                "event_count": len(self.events),
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+            if include_result and self.status == "done":
+                data["result"] = self.result
+            return data
+
+    def sse(self, poll=15):
+        """Yields server-sent events: stage updates, each emitted event, then done/failed."""
+        sent_events = 0
+        sent_stages = {}
+        while True:
+            with self._cond:
+                if (
+                    len(self.events) == sent_events
+                    and self.stages == sent_stages
+                    and not self.finished
+                ):
+                    self._cond.wait(timeout=poll)
+                events = self.events[sent_events:]
+                stages = {k: v for k, v in self.stages.items() if sent_stages.get(k) != v}
+                finished = self.finished
+                sent_events += len(events)
+                sent_stages.update(stages)
+
+            for name, info in stages.items():
+                yield sse_message("stage", dict(info, stage=name))
+            for event in events:
+                yield sse_message("event", event)
+            if finished:
+                yield sse_message(self.status, self.snapshot())
+                return
+            if not events and not stages:
+                yield ": keep-alive\n\n"
+
+
+def sse_message(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class JobManager:
+    """Runs jobs on a worker pool, coalescing jobs submitted with identical keys."""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn):
+        """Starts `fn(job)` in the background, or returns the live job for the same key."""
+        with self._lock:
+            self._expire()
+            existing = self._by_key.get(key)
+            if existing is not None and (
+                not existing.finished
+                or (existing.status == "done" and time.time() - existing.finished_at < JOB_RESULT_TTL)
+            ):
+                return existing, False
+
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+        self._pool.submit(self._run, job, fn)
+        return job, True
+
+    def _run(self, job, fn):
+        job.status = "running"
+        try:
+            job._finish("done", result=fn(job))
+        except Exception as e:
+            print(f"ERROR: Job {job.id} failed: {e}")
+            job._finish("failed", error=str(e))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > JOB_RETENTION:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+
+job_manager = JobManager()
@@ -0,0 +1,458 @@
+"""Single entry point for Gemini calls that must return JSON.
+
+Requests schema-constrained output, repairs near-miss JSON locally, validates
+the result against the call site's schema and only then retries. Parse
+failures, repairs and retries are counted per call site. Every request goes
+through the shared scheduler in llm_scheduler, which enforces the per-model
+rate budgets and priority classes.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from categories import CATEGORIES
+from metrics import count_tokens, observe_stage, span
+from llm_scheduler import gemini_scheduler, estimate_tokens, SchedulerBusy, INTERACTIVE, BACKGROUND
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+MODELS = ("gemini-1.5-flash", "gemini-2.0-flash")
+FENCE_RE = re.compile(r"```[a-zA-Z]*")
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+DEFAULT_RETRIES = 1
+
+# Schemas use the OpenAPI subset accepted by Gemini's response_schema
+CATEGORIZED_EVENTS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string"},
+            "category": {"type": "string", "enum": CATEGORIES},
+        },
+        "required": ["id", "category"],
+    },
+}
+
+FEATURE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": ["Feature"]},
+        "geometry": {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "enum": ["Point"]},
+                "coordinates": {"type": "array", "items": {"type": "number"}},
+            },
+            "required": ["type", "coordinates"],
+        },
+        "properties": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "description": {"type": "string"},
+                "address": {"type": "string"},
+                "time_since_start": {"type": "string"},
+                "transport": {"type": "string"},
+                "cost": {"type": "number"},
+            },
+            "required": ["name", "description", "address", "time_since_start", "transport", "cost"],
+        },
+    },
+    "required": ["type", "geometry", "properties"],
+}
+
+ITINERARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": ["FeatureCollection"]},
+        "features": {"type": "array", "items": FEATURE_SCHEMA},
+        "total_estimated_cost": {"type": "number"},
+        "total_estimated_time": {"type": "number"},
+    },
+    "required": ["type", "features", "total_estimated_cost", "total_estimated_time"],
+}
+
+NARRATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "descriptions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"stop": {"type": "integer"}, "description": {"type": "string"}},
+                "required": ["stop", "description"],
+            },
+        },
+        "restaurants": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "address": {"type": "string"},
+                    "description": {"type": "string"},
+                },
+                "required": ["name", "address", "description"],
+            },
+        },
+    },
+    "required": ["descriptions", "restaurants"],
+}
+
+PREFERENCES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "themes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "theme": {"type": "string"},
+                    "weight": {"type": "number"},
+                    "keywords": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["theme", "weight"],
+            },
+        },
+        "summary": {"type": "string"},
+    },
+    "required": ["themes"],
+}
+
+
+_models = {}
+_models_lock = threading.Lock()
+_configured = False
+
+
+def gemini_model(name=DEFAULT_MODEL, system_instruction=None):
+    """Shared GenerativeModel per name; the SDK is imported and configured on first use."""
+    global _configured
+    with _models_lock:
+        key = (name, system_instruction)
+        if key not in _models:
+            import google.generativeai as genai
+
+            if not _configured:
+                genai.configure(api_key=os.environ["API_KEY"])
+                _configured = True
+            _models[key] = genai.GenerativeModel(model_name=name, system_instruction=system_instruction)
+        return _models[key]
+
+
+def warm_models(names=MODELS):
+    """Builds the shared clients ahead of the first request that needs them."""
+    for name in names:
+        gemini_model(name)
+
+
+def model_name(model):
+    """Registry name of a GenerativeModel ("models/gemini-1.5-flash" -> "gemini-1.5-flash")."""
+    return str(getattr(model, "model_name", DEFAULT_MODEL)).removeprefix("models/")
+
+
+def scheduled_call(model, prompt, priority=INTERACTIVE, **kwargs):
+    """model.generate_content through the scheduler, charging reported token usage afterwards.
+
+    Time spent waiting for admission and in the request itself are timed as
+    the `gemini_queue` and `gemini_request` stages.
+    """
+    name = model_name(model)
+    tokens = estimate_tokens(prompt)
+    waiting_since = [time.monotonic()]
+
+    def request():
+        observe_stage("gemini_queue", time.monotonic() - waiting_since[0])
+        try:
+            with span("gemini_request"):
+                return model.generate_content(prompt, **kwargs)
+        finally:
+            waiting_since[0] = time.monotonic()  # A quota retry waits again
+
+    response = gemini_scheduler().call(name, request, priority=priority, tokens=tokens)
+    record_usage(name, response, tokens)
+    return response
+
+
+def scheduled_stream(model, prompt, priority=INTERACTIVE, **kwargs):
+    """Yields the chunks of a streaming generate_content call made through the scheduler.
+
+    The scheduler slot is held, and `gemini_request` timed, until the last
+    chunk has arrived; token usage is charged once the stream is complete.
+    Admission happens on the first iteration, so SchedulerBusy is raised there.
+    """
+    name = model_name(model)
+    tokens = estimate_tokens(prompt)
+    waiting_since = [time.monotonic()]
+    responses = []
+
+    def request():
+        observe_stage("gemini_queue", time.monotonic() - waiting_since[0])
+        try:
+            with span("gemini_request"):
+                responses.append(model.generate_content(prompt, stream=True, **kwargs))
+                yield from responses[-1]
+        finally:
+            waiting_since[0] = time.monotonic()  # A quota retry waits again
+
+    yield from gemini_scheduler().stream(name, request, priority=priority, tokens=tokens)
+    record_usage(name, responses[-1], tokens)
+
+
+def record_usage(name, response, estimated):
+    """Counts the tokens a (fully received) response reports and settles the scheduler's estimate."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    count_tokens(name, prompt_tokens, response_tokens)
+    gemini_scheduler().record_usage(name, estimated, (prompt_tokens + response_tokens) or estimated)
+
+
+class LLMOutputError(Exception):
+    """Raised when a call site gets no schema-valid JSON after all retries."""
+
+
+class CallStats:
+    """Per-call-site counters for wasted Gemini calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.request_errors = 0
+        self.parse_failures = 0
+        self.validation_failures = 0
+        self.repaired = 0
+        self.retries = 0
+        self.failures = 0
+        self.dropped_items = 0
+        self.rejected = 0
+
+    def as_dict(self):
+        data = dict(vars(self))
+        wasted = self.request_errors + self.parse_failures + self.validation_failures
+        data["wasted_call_rate"] = round(wasted / self.calls, 3) if self.calls else 0.0
+        return data
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(site, counter):
+    with _stats_lock:
+        stats = _stats.setdefault(site, CallStats())
+        setattr(stats, counter, getattr(stats, counter) + 1)
+
+
+def llm_stats():
+    with _stats_lock:
+        return {site: stats.as_dict() for site, stats in _stats.items()}
+
+
+def json_config(schema=None):
+    """generation_config asking Gemini for JSON, constrained to `schema` if given."""
+    config = {"response_mime_type": "application/json"}
+    if schema is not None:
+        config["response_schema"] = schema
+    return config
+
+
+def repair_json(text):
+    """Best-effort fix-up of almost-JSON model output; returns a JSON string.
+
+    Drops Markdown fences and text around the outermost object/array, turns
+    single-quoted strings and Python literals into JSON, removes trailing
+    commas and closes strings and containers left open by a truncated reply.
+    """
+    text = FENCE_RE.sub("", text or "")
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text.strip()
+    text = text[min(starts):]
+
+    out = []
+    stack = []
+    quote = None
+    escape = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if escape:
+                escape = False
+                out.append(ch if ch == "'" else "\\" + ch)  # \' is not a JSON escape
+            elif ch == "\\":
+                escape = True
+            elif ch == quote:
+                quote = None
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')  # Double quote inside a single-quoted string
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break  # Ignore anything after the outermost value
+        elif ch.isalpha():
+            match = re.match(r"[A-Za-z]+", text[i:])
+            word = match.group()
+            if re.match(r"\s*:", text[i + len(word):]):
+                out.append(f'"{word}"')  # Bare object key
+            else:
+                out.append(LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if quote:
+        out.append('"')
+    _strip_trailing_comma(out)
+    if out and out[-1].rstrip().endswith(":"):
+        out.append("null")
+    out.extend(reversed(stack))
+    return "".join(out)
+
+
+def _strip_trailing_comma(out):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def parse_json(text):
+    """Parses model output, falling back to repair_json; returns (value, repaired)."""
+    try:
+        return json.loads(FENCE_RE.sub("", text or "").strip()), False
+    except json.JSONDecodeError:
+        return json.loads(repair_json(text)), True
+
+
+def validate(value, schema, path="$"):
+    """Returns a list of schema violations (empty when `value` conforms)."""
+    if value is None:
+        return [] if schema.get("nullable") else [f"{path}: null"]
+    kind = schema.get("type")
+    checks = {
+        "object": lambda v: isinstance(v, dict),
+        "array": lambda v: isinstance(v, list),
+        "string": lambda v: isinstance(v, str),
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+    }
+    if kind in checks and not checks[kind](value):
+        return [f"{path}: expected {kind}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} not in enum"]
+
+    errors = []
+    if kind == "object":
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}.{key}: missing")
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], sub, f"{path}.{key}"))
+    elif kind == "array" and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def generate_json(
+    model, prompt, site, schema=None, retries=DEFAULT_RETRIES, drop_invalid_items=False, priority=INTERACTIVE
+):
+    """Asks `model` for JSON matching `schema` on behalf of call site `site`.
+
+    Each attempt requests schema-constrained output; output that does not
+    parse is repaired locally before the attempt counts as failed. With
+    `drop_invalid_items`, items of a top-level array that break the schema
+    are dropped (and counted) instead of failing the whole reply. Raises
+    LLMOutputError once `retries` extra attempts are used up, and passes on
+    SchedulerBusy when the scheduler turns the call away.
+    """
+    last_error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            _record(site, "retries")
+        _record(site, "calls")
+        try:
+            response = scheduled_call(model, prompt, priority, generation_config=json_config(schema))
+            text = response.text
+        except SchedulerBusy:
+            _record(site, "rejected")
+            raise
+        except Exception as e:
+            _record(site, "request_errors")
+            last_error = f"request failed: {e}"
+            print(f"ERROR: Gemini call for {site} failed: {e}")
+            continue
+
+        try:
+            value, repaired = parse_json(text)
+        except json.JSONDecodeError as e:
+            _record(site, "parse_failures")
+            last_error = f"unparseable JSON: {e}"
+            print(f"ERROR: Gemini returned unparseable JSON for {site}, even after repair.")
+            continue
+        if repaired:
+            _record(site, "repaired")
+
+        if drop_invalid_items and schema is not None and isinstance(value, list):
+            kept = [item for item in value if not validate(item, schema["items"])]
+            for _ in range(len(value) - len(kept)):
+                _record(site, "dropped_items")
+            value = kept
+        errors = validate(value, schema) if schema is not None else []
+        if errors:
+            _record(site, "validation_failures")
+            last_error = f"schema mismatch: {'; '.join(errors[:3])}"
+            print(f"ERROR: Gemini output for {site} does not match its schema: {errors[:3]}")
+            continue
+        return value
+
+    _record(site, "failures")
+    raise LLMOutputError(f"{site}: {last_error}")
+
+
+def stream_text(model, prompt, site, schema=None, priority=INTERACTIVE):
+    """Yields text chunks of a schema-constrained streaming response."""
+    _record(site, "calls")
+    try:
+        for chunk in scheduled_stream(model, prompt, priority, generation_config=json_config(schema)):
+            try:
+                yield chunk.text
+            except ValueError:  # Chunk without text parts (e.g. safety metadata)
+                continue
+    except SchedulerBusy:
+        _record(site, "rejected")
+        raise
+    except Exception:
+        _record(site, "request_errors")
+        raise
+
+
+def record_parse_failure(site):
+    """Lets streaming call sites, which parse their own output, count failures too."""
+    _record(site, "parse_failures")
@@ -0,0 +1,274 @@
+"""Shared admission control for every Gemini request.
+
+A call waits here for a concurrency slot and for its model's request and
+token budgets (token buckets refilled per minute). Waiters queue per
+priority class and model, FIFO within a queue; a higher class goes first
+unless its model is out of budget, so one exhausted model never holds up
+calls to another. Each class has a bounded number of waiters; a caller
+that finds it full, or that waits longer than its class allows, gets
+SchedulerBusy instead of piling onto an exhausted quota. A quota error from
+the API puts the model into a cool-down with exponential backoff, and the
+call is retried at the front of its queue. A streamed call keeps its slot
+until the stream is exhausted or closed.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+
+INTERACTIVE = 0  # A user is waiting on the reply (itineraries, narration, preferences)
+BACKGROUND = 1  # Work that can lag (categorization)
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))  # Free-tier flash limits
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "4"))
+QUEUE_LIMITS = {INTERACTIVE: 32, BACKGROUND: 64}
+QUEUE_TIMEOUTS = {INTERACTIVE: 30.0, BACKGROUND: 120.0}  # Seconds a caller may wait for admission
+QUOTA_RETRIES = 3
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 32.0
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKENS = 1024  # Assumed reply size until the response reports its usage
+
+
+class SchedulerBusy(Exception):
+    """Raised instead of queueing a call that could not be served in time."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(prompt, output_tokens=OUTPUT_TOKENS):
+    return len(str(prompt)) // CHARS_PER_TOKEN + output_tokens
+
+
+def is_quota_error(error):
+    """ResourceExhausted / HTTP 429, matched without importing google.api_core."""
+    return (
+        type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+        or getattr(error, "code", None) == 429
+        or "quota" in str(error).lower()
+    )
+
+
+class RateBudget:
+    """Token bucket refilled at `per_minute`, holding at most one minute's worth.
+
+    Not locked itself; the scheduler only touches it under its own lock.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` (capped at the capacity) is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class GeminiScheduler:
+    """Priority admission of Gemini calls against per-model RPM/TPM budgets."""
+
+    def __init__(
+        self,
+        rpm=GEMINI_RPM,
+        tpm=GEMINI_TPM,
+        max_in_flight=MAX_IN_FLIGHT,
+        queue_limits=QUEUE_LIMITS,
+        queue_timeouts=QUEUE_TIMEOUTS,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_in_flight = max_in_flight
+        self.queue_limits = dict(queue_limits)
+        self.queue_timeouts = dict(queue_timeouts)
+        self._cond = threading.Condition()
+        self._queues = {}  # (priority, model) -> deque of tickets
+        self._budgets = {}
+        self._cooldowns = {}
+        self._in_flight = 0
+        self._counts = {
+            name: {"admitted": 0, "rejected": 0, "timed_out": 0, "wait_time": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self._models = {}
+
+    def _budget(self, model):
+        if model not in self._budgets:
+            self._budgets[model] = (RateBudget(self.rpm), RateBudget(self.tpm))
+            self._models[model] = {"requests": 0, "quota_errors": 0, "estimated_tokens": 0, "used_tokens": 0}
+        return self._budgets[model]
+
+    def call(self, model, fn, priority=INTERACTIVE, tokens=0):
+        """Runs `fn()` once admitted for `model`, retrying quota errors with backoff.
+
+        `tokens` is the estimated request size drawn from the token budget.
+        Raises SchedulerBusy when the priority class's queue is full or
+        admission takes longer than its timeout.
+        """
+        for attempt in range(QUOTA_RETRIES + 1):
+            self._admit(model, priority, tokens, retry=attempt > 0)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_quota_error(e) or attempt == QUOTA_RETRIES:
+                    raise
+                self._back_off(model, attempt, e)
+            finally:
+                self._release()
+
+    def stream(self, model, fn, priority=INTERACTIVE, tokens=0):
+        """Like call for a streaming `fn()`: yields its items, holding the slot until they run out.
+
+        The slot is also released if the caller closes the generator early. A
+        quota error before the first item is retried with backoff; one that
+        arrives mid-stream still cools the model down but is raised, since the
+        caller already has part of the output.
+        """
+        for attempt in range(QUOTA_RETRIES + 1):
+            self._admit(model, priority, tokens, retry=attempt > 0)
+            started = False
+            try:
+                for item in fn():
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise
+                self._back_off(model, attempt, e)
+                if started or attempt == QUOTA_RETRIES:
+                    raise
+            finally:
+                self._release()
+
+    def record_usage(self, model, estimated, used):
+        """Charges the token budget for the difference between estimate and reported usage."""
+        with self._cond:
+            self._budget(model)[1].take(used - estimated)
+            self._models[model]["used_tokens"] += used
+
+    def _admit(self, model, priority, tokens, retry=False):
+        name = PRIORITY_NAMES[priority]
+        started = time.monotonic()
+        deadline = started + self.queue_timeouts[priority]
+        ticket = {"tokens": tokens}
+        with self._cond:
+            queue = self._queues.setdefault((priority, model), deque())
+            if not retry and self._waiting(priority) >= self.queue_limits[priority]:
+                self._counts[name]["rejected"] += 1
+                raise SchedulerBusy(f"Gemini {name} queue is full", self._retry_after(model))
+            if retry:
+                queue.appendleft(ticket)  # A backed-off call keeps its place
+            else:
+                queue.append(ticket)
+
+            while True:
+                now = time.monotonic()
+                wait = self._ready_in(ticket, priority, model, now)
+                if wait == 0:
+                    break
+                timeout = deadline - now if wait is None else min(wait, deadline - now)
+                if timeout <= 0:
+                    queue.remove(ticket)
+                    self._counts[name]["timed_out"] += 1
+                    self._cond.notify_all()
+                    raise SchedulerBusy(f"Timed out waiting for a Gemini {name} slot", self._retry_after(model))
+                self._cond.wait(timeout)
+
+            queue.popleft()
+            requests, token_budget = self._budget(model)
+            requests.take(1)
+            token_budget.take(tokens)
+            self._in_flight += 1
+            self._counts[name]["admitted"] += 1
+            self._counts[name]["wait_time"] += time.monotonic() - started
+            self._models[model]["requests"] += 1
+            self._models[model]["estimated_tokens"] += tokens
+            self._cond.notify_all()
+
+    def _waiting(self, priority):
+        return sum(len(q) for (p, _), q in self._queues.items() if p == priority)
+
+    def _budget_wait(self, model, tokens, now):
+        """Seconds until `model` has budget for a call of `tokens` (0 = now)."""
+        requests, token_budget = self._budget(model)
+        return max(
+            0.0,
+            self._cooldowns.get(model, 0.0) - now,
+            requests.wait_time(1, now),
+            token_budget.wait_time(tokens, now),
+        )
+
+    def _ready_in(self, ticket, priority, model, now):
+        """Seconds until `ticket` may start (0 = now), or None until another call moves first.
+
+        Higher-priority heads only hold this ticket back while their own model
+        has budget (they are then just waiting for a slot).
+        """
+        if self._queues[(priority, model)][0] is not ticket:
+            return None
+        for (other, other_model), queue in self._queues.items():
+            if other < priority and queue and self._budget_wait(other_model, queue[0]["tokens"], now) == 0:
+                return None
+        if self._in_flight >= self.max_in_flight:
+            return None
+        return self._budget_wait(model, ticket["tokens"], now)
+
+    def _retry_after(self, model):
+        now = time.monotonic()
+        requests, _ = self._budget(model)
+        return max(1, round(max(self._cooldowns.get(model, 0.0) - now, requests.wait_time(1, now))))
+
+    def _back_off(self, model, attempt, error):
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.75, 1.25)
+        print(f"WARNING: Gemini quota exhausted for {model}, backing off {delay:.1f}s: {error}")
+        self._cool_down(model, delay)
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _cool_down(self, model, delay):
+        with self._cond:
+            self._budget(model)
+            self._models[model]["quota_errors"] += 1
+            self._cooldowns[model] = max(self._cooldowns.get(model, 0.0), time.monotonic() + delay)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": {name: self._waiting(p) for p, name in PRIORITY_NAMES.items()},
+                "classes": {
+                    name: dict(counts, wait_time=round(counts["wait_time"], 3))
+                    for name, counts in self._counts.items()
+                },
+                "models": {model: dict(counts) for model, counts in self._models.items()},
+            }
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def gemini_scheduler():
+    """Returns the process-wide scheduler, creating it on first use."""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = GeminiScheduler()
+        return _shared_scheduler
@@ -0,0 +1,201 @@
+"""Per-stage timing spans and counters, exposed in the Prometheus text format.
+
+`span(stage)` times a block into the stage histogram. Gemini token usage and
+cache lookups are counters (hit ratio = hits / all lookups of a cache). With
+METRICS_REQUEST_LOG on, each request also collects its own spans and counts
+and prints them as one breakdown line when it finishes; work handed to pool
+threads keeps counting toward the request if submitted through `carry`.
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+REQUEST_LOG = os.getenv("METRICS_REQUEST_LOG", "false").lower() == "true"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonic counter per label combination."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {round(total, 6)}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+stage_seconds = Histogram("eventopia_stage_seconds", "Wall time of pipeline stages.", ["stage"])
+request_seconds = Histogram(
+    "eventopia_request_seconds", "Wall time of HTTP requests.", ["route", "method", "status"]
+)
+llm_tokens = Counter("eventopia_llm_tokens_total", "Gemini tokens reported by responses.", ["model", "kind"])
+cache_lookups = Counter("eventopia_cache_lookups_total", "Cache lookups by outcome.", ["cache", "result"])
+REGISTRY = [stage_seconds, request_seconds, llm_tokens, cache_lookups]
+
+
+def exposition():
+    """All metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+class Breakdown:
+    """One request's stage times and counts, filled in from any thread working for it."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            total, calls = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, calls + 1)
+
+    def add_count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self, method, path, status):
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][0])
+            counts = sorted(self.counts.items())
+        parts = [f"{method} {path} {status} {time.monotonic() - self.started:.3f}s"]
+        if stages:
+            parts.append(", ".join(f"{s} {t:.3f}s x{n}" for s, (t, n) in stages))
+        if counts:
+            parts.append(", ".join(f"{name}={value}" for name, value in counts))
+        return " | ".join(parts)
+
+
+_breakdown = contextvars.ContextVar("breakdown", default=None)
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add_stage(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as `stage`."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.monotonic() - started)
+
+
+def count_cache(cache, hit, amount=1):
+    if amount <= 0:
+        return
+    result = "hit" if hit else "miss"
+    cache_lookups.inc(cache, result, amount=amount)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add_count(f"{cache}_{result}", amount)
+
+
+def count_tokens(model, prompt_tokens, response_tokens):
+    llm_tokens.inc(model, "prompt", amount=prompt_tokens)
+    llm_tokens.inc(model, "response", amount=response_tokens)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add_count("prompt_tokens", prompt_tokens)
+        breakdown.add_count("response_tokens", response_tokens)
+
+
+def carry(fn):
+    """Wraps `fn` for a pool thread so its spans and counts join the submitting request."""
+    breakdown = _breakdown.get()
+    if breakdown is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _breakdown.set(breakdown)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _breakdown.reset(token)
+
+    return run
+
+
+def start_request():
+    """Starts timing a request (and its breakdown when REQUEST_LOG is on); pass the result to finish_request."""
+    token = _breakdown.set(Breakdown()) if REQUEST_LOG else None
+    return time.monotonic(), token
+
+
+def finish_request(state, route, method, path, status):
+    """Records the request latency and prints its breakdown if one was collected."""
+    started, token = state
+    request_seconds.observe(time.monotonic() - started, route, method, status)
+    if token is not None:
+        breakdown = _breakdown.get()
+        _breakdown.reset(token)
+        print(f"TIMING: {breakdown.summary(method, path, status)}")
@@ -0,0 +1,338 @@
+"""Deterministic local itinerary solver.
+
+Treats itinerary planning as an orienteering problem with time windows and a
+budget: pick and order events from a start location so that every visit fits
+its window, the trip fits the time limit and the total cost fits the budget,
+while maximizing the value of the visited events. Solved with greedy
+cheapest-insertion, which is deterministic and fast enough for hundreds of
+candidates.
+"""
+import math
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from projection import price_hint, compact_json
+from spatial import distance_km
+from llm import generate_json, LLMOutputError, SchedulerBusy, NARRATION_SCHEMA
+
+SPEEDS_KMH = {"walking": 4.5, "public": 20.0, "private": 35.0}
+TRANSPORT_LABELS = {"walking": "Walking", "public": "Public transport", "private": "Private transport"}
+ROAD_FACTOR = 1.3  # Straight-line to street distance
+DEFAULT_DURATION = 90  # Minutes spent at an event without a known end time
+MAX_CANDIDATES = 80
+CATEGORY_DURATIONS = {
+    "Concerts & Live Music": 150,
+    "Theater & Performing Arts": 150,
+    "Movie Screenings": 120,
+    "Theme Park Events": 240,
+    "Sports & Fitness": 120,
+    "Food & Drink": 90,
+    "Nightlife & Parties": 180,
+}
+
+
+def transport_mode(mode_of_transport):
+    mode = (mode_of_transport or "").lower()
+    if "walk" in mode:
+        return "walking"
+    if "priv" in mode or "car" in mode or "driv" in mode:
+        return "private"
+    return "public"
+
+
+def parse_budget(cost):
+    """'unlimited' or a dollar amount such as '300' or '$50'."""
+    match = re.search(r"\d+(\.\d+)?", str(cost))
+    return float(match.group()) if match else math.inf
+
+
+def parse_start(start_date, start_time, now=None):
+    """Trip start as a datetime from the /get-itinerary start_date and start_time strings."""
+    now = now or datetime.now()
+    day = now.date()
+    if start_date and start_date.lower() != "today":
+        for fmt in ("%m/%d/%Y", "%Y-%m-%d", "%B %d %Y", "%b %d %Y"):
+            try:
+                day = datetime.strptime(start_date.strip(), fmt).date()
+                break
+            except ValueError:
+                continue
+    clock = datetime.min.time()
+    text = (start_time or "").strip().upper().replace(".", "")
+    for fmt in ("%I:%M %p", "%I %p", "%H:%M"):
+        try:
+            clock = datetime.strptime(text, fmt).time()
+            break
+        except ValueError:
+            continue
+    return datetime.combine(day, clock)
+
+
+def parse_duration(time_text, start):
+    """Trip length in minutes from e.g. '3h 15m', '72' (hours) or 'rest of day'."""
+    text = str(time_text or "").lower()
+    hours = re.search(r"(\d+(?:\.\d+)?)\s*h", text)
+    minutes = re.search(r"(\d+)\s*m", text)
+    if hours or minutes:
+        return (float(hours.group(1)) * 60 if hours else 0) + (int(minutes.group(1)) if minutes else 0)
+    number = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(hours?)?\s*", text)
+    if number:
+        return float(number.group(1)) * 60
+    midnight = datetime.combine(start.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - start).total_seconds() / 60
+
+
+def format_minutes(minutes):
+    minutes = int(round(minutes))
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    if minutes or not hours:
+        parts.append(f"{minutes} minute{'s' if minutes != 1 else ''}")
+    return " ".join(parts)
+
+
+def _event_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def event_value(event):
+    """Deterministic desirability of an event: venue quality plus an optional preference score."""
+    venue = event.get("venue") or {}
+    rating = venue.get("rating") or 3.5
+    reviews = venue.get("reviews") or 0
+    return 1.0 + rating / 5 + math.log1p(reviews) / 10 + event.get("preference_score", 0.0)
+
+
+class Candidate:
+    """An event reduced to what the solver needs, in minutes since trip start."""
+
+    def __init__(self, event, start):
+        self.event = event
+        self.value = event_value(event)
+        self.cost = price_hint(event) or 0.0
+        self.open = 0.0
+        self.close = math.inf
+        self.duration = CATEGORY_DURATIONS.get(event.get("category"), DEFAULT_DURATION)
+
+        begins = _event_datetime(event.get("start_datetime"))
+        ends = _event_datetime(event.get("end_datetime"))
+        if begins is not None:
+            self.open = (begins - start).total_seconds() / 60
+        if ends is not None:
+            self.close = (ends - start).total_seconds() / 60
+            # Partial attendance is fine for long events; short ones are seen in full
+            self.duration = min(self.duration, max(self.close - max(self.open, 0), 0))
+
+
+def _simulate(route, candidates, travel, horizon, budget):
+    """Returns (finish time, total cost, arrival times) for a route, or None if infeasible."""
+    t, cost, node, arrivals = 0.0, 0.0, 0, []
+    for index in route:
+        c = candidates[index]
+        t = max(t + travel[node, index + 1], c.open)
+        if t + c.duration > c.close:
+            return None
+        arrivals.append(t)
+        t += c.duration
+        cost += c.cost
+        node = index + 1
+    if t > horizon or cost > budget:
+        return None
+    return t, cost, arrivals
+
+
+def _schedule(route, candidates, travel, horizon):
+    """Start times, waits and forward slack of a feasible route.
+
+    `slack[k]` is how far the start of stop k may be pushed back without
+    breaking any later window or the horizon (waiting absorbs delay), and
+    `waits[k]` is the idle time before stop k. A trailing entry covers the
+    end of the trip.
+    """
+    starts, waits = [], []
+    t, node = 0.0, 0
+    for index in route:
+        c = candidates[index]
+        arrival = t + travel[node, index + 1]
+        starts.append(max(arrival, c.open))
+        waits.append(starts[-1] - arrival)
+        t = starts[-1] + c.duration
+        node = index + 1
+    waits.append(0.0)
+    slack = [0.0] * len(route) + [horizon - t]
+    for k in range(len(route) - 1, -1, -1):
+        c = candidates[route[k]]
+        slack[k] = min(c.close - c.duration - starts[k], waits[k + 1] + slack[k + 1])
+    return starts, waits, slack, t
+
+
+def solve(candidates, travel, horizon, budget):
+    """Greedy cheapest insertion: repeatedly add the event with the best value per added minute.
+
+    Each insertion is checked in O(1) against the current route's start
+    times and forward slack instead of re-simulating the whole route.
+    """
+    route = []
+    spent = 0.0
+    remaining = set(range(len(candidates)))
+    while remaining:
+        starts, waits, slack, finish = _schedule(route, candidates, travel, horizon)
+        # Idle time from each position to the end, which absorbs a pushed-back start
+        idle_after = [0.0] * (len(route) + 1)
+        for k in range(len(route) - 1, -1, -1):
+            idle_after[k] = idle_after[k + 1] + waits[k + 1]
+        departs = [0.0] + [starts[k] + candidates[route[k]].duration for k in range(len(route))]
+        nodes = [0] + [index + 1 for index in route]
+
+        best = None
+        for index in sorted(remaining):
+            c = candidates[index]
+            if spent + c.cost > budget:
+                continue
+            for position in range(len(route) + 1):
+                begin = max(departs[position] + travel[nodes[position], index + 1], c.open)
+                leave = begin + c.duration
+                if leave > c.close:
+                    continue
+                if position == len(route):
+                    if leave > horizon:
+                        continue
+                    new_finish = leave
+                else:
+                    following = route[position]
+                    next_start = max(leave + travel[index + 1, following + 1], candidates[following].open)
+                    delay = next_start - starts[position]
+                    if delay > slack[position] + 1e-9:
+                        continue
+                    new_finish = finish + max(0.0, delay - idle_after[position])
+                ratio = c.value / (new_finish - finish + 1)
+                if best is None or ratio > best[0]:
+                    best = (ratio, index, position)
+        if best is None:
+            break
+        _, index, position = best
+        route.insert(position, index)
+        spent += candidates[index].cost
+        remaining.discard(index)
+    return route
+
+
+def plan_itinerary(
+    events,
+    start_location,
+    time_text="rest of day",
+    start_date="today",
+    start_time="09:00 AM",
+    cost="unlimited",
+    mode_of_transport="public",
+    distance_matrix=None,
+):
+    """Builds a feasible itinerary as the GeoJSON FeatureCollection used by final_itenary.json.
+
+    `start_location` is a (lat, lon) pair. `distance_matrix`, if given, is a
+    callable returning km distances between two lists of (lat, lon) points;
+    it defaults to spatial.distance_km.
+    """
+    start = parse_start(start_date, start_time)
+    horizon = parse_duration(time_text, start)
+    budget = parse_budget(cost)
+    mode = transport_mode(mode_of_transport)
+
+    located = [e for e in events if e.get("latitude") is not None and e.get("longitude") is not None]
+    candidates = [Candidate(e, start) for e in located]
+    if not candidates:
+        return feature_collection([], [], 0, TRANSPORT_LABELS[mode])
+
+    points = [tuple(start_location)] + [(c.event["latitude"], c.event["longitude"]) for c in candidates]
+    km = (distance_matrix or distance_km)(points, points)
+    travel = np.asarray(km) * ROAD_FACTOR / SPEEDS_KMH[mode] * 60
+
+    # Drop events that cannot be reached alone, then keep the most promising ones
+    reach = np.maximum(travel[0, 1:], [c.open for c in candidates])
+    feasible = [
+        i for i, c in enumerate(candidates)
+        if reach[i] + c.duration <= min(c.close, horizon) and c.cost <= budget
+    ]
+    feasible.sort(key=lambda i: (-candidates[i].value / (reach[i] + candidates[i].duration + 1), i))
+    keep = feasible[:MAX_CANDIDATES]
+
+    subset = [candidates[i] for i in keep]
+    sub_travel = travel[np.ix_([0] + [i + 1 for i in keep], [0] + [i + 1 for i in keep])]
+    route = solve(subset, sub_travel, horizon, budget)
+    if not route:
+        return feature_collection([], [], 0, TRANSPORT_LABELS[mode])
+
+    finish, _, arrivals = _simulate(route, subset, sub_travel, horizon, budget)
+    return feature_collection([subset[i] for i in route], arrivals, finish, TRANSPORT_LABELS[mode])
+
+
+def feature_collection(stops, arrivals, finish, transport):
+    """Formats a solved route; `arrivals` and `finish` are minutes since trip start."""
+    features = []
+    for candidate, arrival in zip(stops, arrivals):
+        event = candidate.event
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [event["longitude"], event["latitude"]],
+                },
+                "properties": {
+                    "name": event.get("title", ""),
+                    "description": event.get("description", ""),
+                    "address": ", ".join(event.get("address") or []),
+                    "generated": False,
+                    "time_since_start": format_minutes(arrival),
+                    "transport": transport,
+                    "cost": candidate.cost,
+                },
+            }
+        )
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "total_estimated_cost": round(sum(c.cost for c in stops)),
+        "total_estimated_time": round(finish / 60, 1),
+    }
+
+
+def narrate_itinerary(itinerary, model):
+    """Optionally lets Gemini rewrite stop descriptions and suggest nearby restaurants.
+
+    The planned stops, times and costs are never changed; on any failure the
+    itinerary is returned as planned.
+    """
+    stops = [
+        {"stop": i, "name": f["properties"]["name"], "address": f["properties"]["address"]}
+        for i, f in enumerate(itinerary["features"])
+    ]
+    if not stops:
+        return itinerary
+    query = (
+        "For each stop of this itinerary write a one-sentence description, and suggest up to "
+        "three restaurants near the stops. Give descriptions as a list of "
+        '{"stop": <stop number>, "description": "..."} objects. '
+        f"Stops: {compact_json(stops)}"
+    )
+    try:
+        narration = generate_json(model, query, "narrate", NARRATION_SCHEMA)
+    except (LLMOutputError, SchedulerBusy) as e:
+        print(f"ERROR: Itinerary narration failed, keeping planned descriptions: {e}")
+        return itinerary
+
+    features = itinerary["features"]
+    for row in narration["descriptions"]:
+        if 0 <= row["stop"] < len(features):
+            features[row["stop"]]["properties"]["description"] = row["description"]
+    itinerary["restaurant_suggestions"] = narration["restaurants"]
+    return itinerary
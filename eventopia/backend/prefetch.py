@@ -0,0 +1,252 @@
+"""Scheduled prefetch of event sets for hot (location, date range) keys.
+
+Demand is learned from event requests as a decaying hit count per location and
+relative date range ("today", "weekend", or a day offset and span), and
+PREFETCH_KEYS can name keys to keep warm regardless. Each round rebuilds the
+hottest keys whose warm set is missing or about to expire, spending at most
+PREFETCH_DAILY_PAGES search pages a day, and keeps the resulting categorized,
+geocoded event set ready to serve. Run a single round with `python prefetch.py`
+(e.g. from cron), or set PREFETCH_INTERVAL to run rounds in the app.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from corpus import location_key, named_window
+from event_search import DEFAULT_PAGES
+from metrics import count_cache
+from store import session_store
+
+PREFETCH_PATH = os.getenv("PREFETCH_PATH", "json_output/prefetch.db")
+PREFETCH_KEYS = os.getenv("PREFETCH_KEYS", "")  # e.g. "Durham, NC|today;Durham, NC|weekend"
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "0"))  # Seconds between rounds; 0 = no thread
+PREFETCH_DAILY_PAGES = int(os.getenv("PREFETCH_DAILY_PAGES", "50"))
+PREFETCH_SESSION = "prefetch"
+WARM_TTL = 3 * 3600
+REFRESH_AHEAD = 30 * 60  # Rebuild this long before a warm set expires
+HOT_KEYS = 10
+MIN_SCORE = 1.5  # Decayed hits before a learned key is worth prefetching (repeat demand)
+HALF_LIFE = 3 * 24 * 3600
+RANGE_NAMES = ("today", "tomorrow", "weekend", "week")
+
+
+def range_label(start_day, end_day, now=None):
+    """Relative name of a date range: a named window if one matches, else "days:<offset>:<span>"."""
+    now = now or datetime.now()
+    for name in RANGE_NAMES:
+        window_start, window_end = named_window(name, now)
+        if (window_start.date(), window_end.date()) == (start_day, end_day):
+            return name
+    return f"days:{(start_day - now.date()).days}:{(end_day - start_day).days}"
+
+
+def resolve_range(label, now=None):
+    """(start day, end day) a range label stands for as of `now`."""
+    now = now or datetime.now()
+    if label in RANGE_NAMES:
+        window_start, window_end = named_window(label, now)
+        return window_start.date(), window_end.date()
+    _, offset, span = label.split(":")
+    start_day = now.date() + timedelta(days=int(offset))
+    return start_day, start_day + timedelta(days=int(span))
+
+
+def configured_keys(spec=PREFETCH_KEYS):
+    """[(location, range label)] from "location|range;location|range"."""
+    keys = []
+    for item in filter(None, (part.strip() for part in spec.split(";"))):
+        location, _, label = item.partition("|")
+        keys.append((location.strip(), label.strip() or "today"))
+    return keys
+
+
+class Prefetcher:
+    """Learned demand, warm event sets and the daily page budget, in one SQLite file."""
+
+    def __init__(
+        self,
+        path=PREFETCH_PATH,
+        daily_pages=PREFETCH_DAILY_PAGES,
+        warm_ttl=WARM_TTL,
+        refresh_ahead=REFRESH_AHEAD,
+        keys=None,
+    ):
+        self.daily_pages = daily_pages
+        self.warm_ttl = warm_ttl
+        self.refresh_ahead = refresh_ahead
+        self.keys = configured_keys() if keys is None else keys
+        self._lock = threading.Lock()
+        self._thread = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS demand (
+                location_key TEXT NOT NULL,
+                range TEXT NOT NULL,
+                location TEXT NOT NULL,
+                score REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (location_key, range)
+            );
+            CREATE TABLE IF NOT EXISTS warm (
+                location_key TEXT NOT NULL,
+                start_day TEXT NOT NULL,
+                end_day TEXT NOT NULL,
+                set_id TEXT NOT NULL,
+                built_at REAL NOT NULL,
+                PRIMARY KEY (location_key, start_day, end_day)
+            );
+            CREATE TABLE IF NOT EXISTS spend (
+                day TEXT PRIMARY KEY,
+                pages INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def record(self, location, start_day, end_day):
+        """Counts one request for this location and date range toward its demand score."""
+        now = time.time()
+        label = range_label(start_day, end_day)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT score, updated_at FROM demand WHERE location_key = ? AND range = ?",
+                (location_key(location), label),
+            ).fetchone()
+            score = 1.0 + (row[0] * 0.5 ** ((now - row[1]) / HALF_LIFE) if row else 0.0)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO demand VALUES (?, ?, ?, ?, ?)",
+                (location_key(location), label, location, score, now),
+            )
+
+    def lookup(self, location, start_day, end_day):
+        """(set id, events) of a fresh warm set for exactly this location and range, or (None, None)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT set_id FROM warm WHERE location_key = ? AND start_day = ? AND end_day = ? AND built_at > ?",
+                (location_key(location), start_day.isoformat(), end_day.isoformat(), time.time() - self.warm_ttl),
+            ).fetchone()
+        events = session_store().get("events", row[0]) if row else None
+        count_cache("warm", events is not None)
+        return (row[0], events) if events is not None else (None, None)
+
+    def hot_keys(self, limit=HOT_KEYS):
+        """Configured keys first, then learned ones by decayed score: [(location, range label)]."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT location, range, score, updated_at FROM demand").fetchall()
+        learned = sorted(
+            ((score * 0.5 ** ((now - updated_at) / HALF_LIFE), location, label) for location, label, score, updated_at in rows),
+            reverse=True,
+        )
+        keys = list(self.keys)
+        seen = {(location_key(location), label) for location, label in keys}
+        for score, location, label in learned:
+            if score >= MIN_SCORE and (location_key(location), label) not in seen:
+                keys.append((location, label))
+                seen.add((location_key(location), label))
+        return keys[:limit]
+
+    def _due(self, location, start_day, end_day, now):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT built_at FROM warm WHERE location_key = ? AND start_day = ? AND end_day = ?",
+                (location_key(location), start_day.isoformat(), end_day.isoformat()),
+            ).fetchone()
+        return row is None or row[0] + self.warm_ttl - self.refresh_ahead <= now
+
+    def _spend(self, pages):
+        """Charges today's budget; False (and nothing charged) if it would be exceeded."""
+        day = datetime.now().date().isoformat()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT pages FROM spend WHERE day = ?", (day,)).fetchone()
+            used = row[0] if row else 0
+            if used + pages > self.daily_pages:
+                return False
+            self._conn.execute("INSERT OR REPLACE INTO spend VALUES (?, ?)", (day, used + pages))
+        return True
+
+    def run_once(self, build, pages=DEFAULT_PAGES):
+        """Rebuilds due hot keys with `build(location, start_day, end_day)` -> set id, within budget."""
+        summary = {"built": 0, "fresh": 0, "failed": 0, "over_budget": 0}
+        now = time.time()
+        for location, label in self.hot_keys():
+            start_day, end_day = resolve_range(label)
+            if not self._due(location, start_day, end_day, now):
+                summary["fresh"] += 1
+                continue
+            if not self._spend(pages):
+                summary["over_budget"] += 1
+                continue
+            try:
+                set_id = build(location, start_day, end_day)
+            except Exception as e:
+                print(f"ERROR: Prefetch of {location} ({label}) failed: {e}")
+                summary["failed"] += 1
+                continue
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO warm VALUES (?, ?, ?, ?, ?)",
+                    (location_key(location), start_day.isoformat(), end_day.isoformat(), set_id, time.time()),
+                )
+            summary["built"] += 1
+        print(f"Prefetch round: {summary}")
+        return summary
+
+    def start(self, build, interval=PREFETCH_INTERVAL):
+        """Runs a round every `interval` seconds on a daemon thread (once per process)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, args=(build, interval), daemon=True)
+        self._thread.start()
+
+    def _loop(self, build, interval):
+        while True:
+            try:
+                self.run_once(build)
+            except Exception as e:
+                print(f"ERROR: Prefetch round failed: {e}")
+            time.sleep(interval)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            warm = self._conn.execute(
+                "SELECT COUNT(*) FROM warm WHERE built_at > ?", (now - self.warm_ttl,)
+            ).fetchone()[0]
+            row = self._conn.execute(
+                "SELECT pages FROM spend WHERE day = ?", (datetime.now().date().isoformat(),)
+            ).fetchone()
+        return {
+            "warm_sets": warm,
+            "pages_spent_today": row[0] if row else 0,
+            "daily_pages": self.daily_pages,
+            "hot_keys": [{"location": location, "range": label} for location, label in self.hot_keys()],
+        }
+
+
+_shared_prefetcher = None
+_shared_lock = threading.Lock()
+
+
+def prefetcher():
+    """Returns the process-wide prefetcher, opening it on first use."""
+    global _shared_prefetcher
+    with _shared_lock:
+        if _shared_prefetcher is None:
+            _shared_prefetcher = Prefetcher()
+        return _shared_prefetcher
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    import functions
+
+    load_dotenv()
+    prefetcher().run_once(functions.build_warm_set)
@@ -0,0 +1,116 @@
+"""Compact, schema-stable projections of events and history rows for LLM prompts."""
+import hashlib
+import json
+import math
+import os
+import re
+from urllib.parse import urlparse
+
+DESCRIPTION_CHARS = 160
+REPORT_SAVINGS = os.getenv("PROJECTION_REPORT", "false").lower() == "true"  # Serializes the raw payload; debug only
+
+# Every projected row carries exactly these keys, in this order
+EVENT_FIELDS = (
+    "id",
+    "title",
+    "start",
+    "end",
+    "lat",
+    "lon",
+    "category",
+    "price",
+    "venue",
+    "venue_rating",
+    "description",
+)
+ITINERARY_FIELDS = ("id", "title", "start", "end", "lat", "lon", "category", "price", "venue", "venue_rating")
+CATEGORIZE_FIELDS = ("id", "title", "venue", "description")
+
+PRICE_RE = re.compile(r"\$\s?(\d+(?:\.\d{1,2})?)")
+FREE_RE = re.compile(r"\bfree\b", re.IGNORECASE)
+
+
+def event_fingerprint(event):
+    """Stable id for an event across searches: title, start date and address."""
+    parts = [
+        event.get("title", ""),
+        (event.get("date") or {}).get("start_date", ""),
+        ", ".join(event.get("address") or []),
+    ]
+    normalized = "|".join(re.sub(r"\s+", " ", str(p).lower()).strip() for p in parts)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def price_hint(event):
+    """Cheapest dollar amount mentioned in the title or description, 0 for free, else None."""
+    text = f"{event.get('title', '')} {event.get('description', '')}"
+    prices = [float(p) for p in PRICE_RE.findall(text)]
+    if prices:
+        return min(prices)
+    return 0 if FREE_RE.search(text) else None
+
+
+def _round(value, digits=5):
+    return round(value, digits) if isinstance(value, (int, float)) else None
+
+
+def project_event(event, fields=ITINERARY_FIELDS):
+    """Reduces a raw SerpAPI event to the requested subset of EVENT_FIELDS."""
+    date = event.get("date") or {}
+    venue = event.get("venue") or {}
+    description = event.get("description") or ""
+    row = {
+        "id": event.get("id") or event_fingerprint(event),
+        "title": event.get("title", ""),
+        "start": event.get("start_datetime") or date.get("when") or date.get("start_date"),
+        "end": event.get("end_datetime"),
+        "lat": _round(event.get("latitude")),
+        "lon": _round(event.get("longitude")),
+        "category": event.get("category"),
+        "price": price_hint(event),
+        "venue": venue.get("name"),
+        "venue_rating": venue.get("rating"),
+        "description": description[:DESCRIPTION_CHARS],
+    }
+    return {field: row[field] for field in fields}
+
+
+def project_history(row):
+    """Reduces a browsing-history record to title, domain and visit count."""
+    url = row.get("URL") or row.get("url") or ""
+    return {
+        "title": row.get("Title") or row.get("title") or "",
+        "domain": urlparse(url).netloc.removeprefix("www."),
+        "visits": row.get("Visit Count") or row.get("visit_count") or 1,
+    }
+
+
+def compact_json(data):
+    """JSON without indentation or spaces after separators."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def estimate_tokens(text):
+    """Rough token count for English/JSON text (about four characters per token)."""
+    return math.ceil(len(text) / 4)
+
+
+def project_events(events, fields=ITINERARY_FIELDS, label="prompt"):
+    """Projects a list of events and reports the estimated prompt-token saving."""
+    rows = [project_event(event, fields) for event in events]
+    report_savings(label, events, rows)
+    return rows
+
+
+def report_savings(label, raw, projected):
+    """Prints and returns (tokens before, tokens after) for a projected payload.
+
+    Only with PROJECTION_REPORT on, since it serializes the whole raw payload;
+    otherwise returns None.
+    """
+    if not REPORT_SAVINGS:
+        return None
+    before = estimate_tokens(json.dumps(raw, ensure_ascii=False))
+    after = estimate_tokens(compact_json(projected))
+    print(f"Projection [{label}]: ~{before} -> ~{after} input tokens")
+    return before, after
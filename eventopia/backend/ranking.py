@@ -0,0 +1,133 @@
+"""Local preference profile and vectorized event ranking.
+
+The profile is a compact weighted term vector (from preference themes and the
+browsing-history profile) plus the category affinities it implies under the
+event classifier. Candidate events are scored against it in one NumPy pass,
+blended with distance, venue quality and price, and only the top K go on to
+the itinerary stage.
+"""
+import math
+
+import numpy as np
+
+from categories import CATEGORIES, canonical_category
+from classifier import event_classifier, event_terms, tokenize
+from projection import price_hint
+from spatial import distance_km
+
+PROFILE_VERSION = 1
+PROFILE_TERMS = 200
+HISTORY_WEIGHT = 0.5  # Browsing-history terms count half as much as explicit themes
+TOP_K = 40
+DISTANCE_SCALE_KM = 5.0  # Proximity halves roughly every 3.5 km
+PRICE_SCALE = 30.0  # Dollars at which affordability drops to one half
+UNKNOWN_PRICE = 0.5
+WEIGHTS = {"preference": 0.45, "distance": 0.25, "quality": 0.2, "price": 0.1}
+
+
+def build_profile(preferences=None, history=None):
+    """Compact vector profile from Gemini preference themes and/or the history profile.
+
+    `preferences` is the PREFERENCES_SCHEMA object, `history` the dict from
+    HistoryProfile.compact(). Returns None when neither has any terms.
+    """
+    terms = {}
+    for theme in (preferences or {}).get("themes", []):
+        weight = float(theme.get("weight") or 0.5)
+        text = " ".join([theme.get("theme", "")] + list(theme.get("keywords") or []))
+        for token in set(tokenize(text)):
+            terms[token] = terms.get(token, 0.0) + weight
+
+    history_terms = (history or {}).get("terms", [])
+    if history_terms:
+        top = math.log1p(max(t["visits"] for t in history_terms))
+        for row in history_terms:
+            for token in tokenize(row["term"]):
+                terms[token] = terms.get(token, 0.0) + HISTORY_WEIGHT * math.log1p(row["visits"]) / top
+    if not terms:
+        return None
+
+    top_terms = sorted(terms.items(), key=lambda item: (-item[1], item[0]))[:PROFILE_TERMS]
+    norm = math.sqrt(sum(w * w for _, w in top_terms))
+    vector = {term: round(w / norm, 4) for term, w in top_terms}
+
+    # Category affinities: the profile's terms pushed through the classifier weights
+    classifier = event_classifier()
+    term_vector = np.zeros(len(classifier.vocab))
+    for term, weight in vector.items():
+        col = classifier.index.get(term)
+        if col is not None:
+            term_vector[col] = weight
+    affinity = classifier.weights @ term_vector
+    if affinity.max() > 0:
+        affinity /= affinity.max()
+    return {
+        "version": PROFILE_VERSION,
+        "terms": vector,
+        "categories": {c: round(float(a), 4) for c, a in zip(CATEGORIES, affinity) if a > 0},
+    }
+
+
+def preference_scores(events, profile):
+    """Cosine match of each event's terms with the profile, blended with its category affinity."""
+    if not profile or not events:
+        return np.zeros(len(events))
+    vocab = list(profile["terms"])
+    index = {term: i for i, term in enumerate(vocab)}
+    weights = np.array([profile["terms"][t] for t in vocab])
+
+    matrix = np.zeros((len(events), len(vocab)))
+    for row, event in enumerate(events):
+        for term, count in event_terms(event).items():
+            col = index.get(term)
+            if col is not None:
+                matrix[row, col] = count
+    norms = np.linalg.norm(matrix, axis=1)
+    text_match = (matrix @ weights) / np.maximum(norms, 1e-9)
+
+    affinities = profile.get("categories", {})
+    category_match = np.array(
+        [affinities.get(canonical_category(e.get("category") or ""), 0.0) for e in events]
+    )
+    return 0.6 * text_match + 0.4 * category_match
+
+
+def rank_events(events, start_location=None, profile=None, budget=math.inf, top_k=TOP_K):
+    """Scores events in one vectorized pass and returns the best `top_k` (all if None), best first.
+
+    Each returned event gets `preference_score` (read by planner.event_value)
+    and `rank_score`. Events are copied, never modified in place.
+    """
+    if not events:
+        return []
+    n = len(events)
+    preference = preference_scores(events, profile)
+
+    proximity = np.zeros(n)
+    located = np.array([e.get("latitude") is not None and e.get("longitude") is not None for e in events])
+    if start_location is not None and located.any():
+        points = [(e["latitude"], e["longitude"]) for e in events if e.get("latitude") is not None and e.get("longitude") is not None]
+        proximity[located] = np.exp(-distance_km([tuple(start_location)], points)[0] / DISTANCE_SCALE_KM)
+
+    venues = [e.get("venue") or {} for e in events]
+    ratings = np.array([v.get("rating") or 3.5 for v in venues], dtype=float)
+    reviews = np.log1p(np.array([v.get("reviews") or 0 for v in venues], dtype=float))
+    quality = 0.7 * ratings / 5 + 0.3 * reviews / max(reviews.max(), 1e-9)
+
+    prices = np.array([np.nan if p is None else p for p in map(price_hint, events)], dtype=float)
+    known = ~np.isnan(prices)
+    affordability = np.full(n, UNKNOWN_PRICE)
+    affordability[known] = 1 / (1 + prices[known] / PRICE_SCALE)
+    affordability[known & (np.nan_to_num(prices) > budget)] = 0.0
+
+    score = (
+        WEIGHTS["preference"] * preference
+        + WEIGHTS["distance"] * proximity
+        + WEIGHTS["quality"] * quality
+        + WEIGHTS["price"] * affordability
+    )
+    order = np.argsort(-score, kind="stable")[:top_k]
+    return [
+        dict(events[i], preference_score=round(float(preference[i]), 4), rank_score=round(float(score[i]), 4))
+        for i in order
+    ]
@@ -0,0 +1,127 @@
+"""TTL cache for events search pages with stale-while-revalidate."""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import count_cache
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 30 * 60))
+SEARCH_CACHE_GRACE = float(os.getenv("SEARCH_CACHE_GRACE", 60 * 60))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 512))
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", str(text).lower()).strip(" ,")
+
+
+def search_key(user_location, start_date, end_date, page, hl="en", gl="us"):
+    """Cache key for one results page of an events search."""
+    return (
+        _normalize(user_location),
+        _normalize(start_date),
+        _normalize(end_date),
+        int(page),
+        hl,
+        gl,
+    )
+
+
+class SearchCache:
+    """Size-bounded LRU of search pages.
+
+    Entries younger than `ttl` are served as-is. Entries up to `grace`
+    seconds past their TTL are still served, but trigger one background
+    refresh. Older entries count as misses and are fetched inline.
+
+    Pages are kept as JSON text and decoded on every hit, so each caller gets
+    its own event dicts to annotate, geocode and categorize; nothing handed
+    out (or already stored in a session) is shared with a later request.
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, grace=SEARCH_CACHE_GRACE, max_entries=SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.grace = grace
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=2)
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "evictions": 0,
+        }
+
+    def _count(self, name):
+        self.counters[name] += 1
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (json.dumps(value), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count("evictions")
+
+    def _refresh(self, key, fetch):
+        try:
+            self._store(key, fetch())
+            with self._lock:
+                self._count("refreshes")
+        except Exception as e:
+            print(f"ERROR: Background refresh failed for {key}: {e}")
+            with self._lock:
+                self._count("refresh_failures")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(self, key, fetch):
+        """Returns the cached value for `key`, calling `fetch()` on a miss.
+
+        Exceptions from an inline fetch propagate and nothing is cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = time.time() - fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._count("hits")
+                    count_cache("search", True)
+                    return json.loads(value)
+                if age < self.ttl + self.grace:
+                    self._entries.move_to_end(key)
+                    self._count("stale_hits")
+                    count_cache("search", True)
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._refresher.submit(self._refresh, key, fetch)
+                    return json.loads(value)
+                del self._entries[key]
+            self._count("misses")
+        count_cache("search", False)
+
+        value = fetch()
+        self._store(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, entries=len(self._entries))
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 3) if lookups else 0.0
+        stats["ttl"] = self.ttl
+        stats["grace"] = self.grace
+        return stats
+
+
+search_cache = SearchCache()
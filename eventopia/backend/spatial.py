@@ -0,0 +1,124 @@
+"""Vectorized distances and a grid index over geocoded events."""
+import math
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from projection import event_fingerprint
+
+EARTH_RADIUS_KM = 6371.0
+CELL_KM = 2.0  # Grid cell edge; radius queries scan the cells overlapping their bounding box
+KM_PER_DEGREE = 111.32
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """Great-circle distances in km between every pair of two coordinate arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    dlat = lat2[None, :] - lat1[:, None]
+    dlon = lon2[None, :] - lon1[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1)[:, None] * np.cos(lat2)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def distance_km(points_a, points_b):
+    """Distance matrix in km between two lists of (lat, lon) points."""
+    lat_a, lon_a = np.asarray(points_a, dtype=float).reshape(-1, 2).T
+    lat_b, lon_b = np.asarray(points_b, dtype=float).reshape(-1, 2).T
+    return haversine_matrix(lat_a, lon_a, lat_b, lon_b)
+
+
+def _cell(lat, lon):
+    size = CELL_KM / KM_PER_DEGREE
+    return math.floor(lat / size), math.floor(lon / size)
+
+
+class EventIndex:
+    """Grid index over event coordinates for radius queries, extended as events arrive."""
+
+    def __init__(self):
+        self.events = []
+        self.ids = {}
+        self.lats = np.zeros(0)
+        self.lons = np.zeros(0)
+        self.grid = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, events):
+        """Adds geocoded events not already indexed; returns how many were new."""
+        new = []
+        with self._lock:
+            for event in events:
+                if event.get("latitude") is None or event.get("longitude") is None:
+                    continue
+                key = event_fingerprint(event)
+                if key in self.ids:
+                    continue
+                self.ids[key] = len(self.events) + len(new)
+                new.append(event)
+            if not new:
+                return 0
+
+            new_lats = np.array([e["latitude"] for e in new], dtype=float)
+            new_lons = np.array([e["longitude"] for e in new], dtype=float)
+            for offset, (lat, lon) in enumerate(zip(new_lats, new_lons)):
+                self.grid[_cell(lat, lon)].append(len(self.events) + offset)
+
+            self.events.extend(new)
+            self.lats = np.concatenate([self.lats, new_lats])
+            self.lons = np.concatenate([self.lons, new_lons])
+        return len(new)
+
+    def within(self, lat, lon, radius_km):
+        """Returns [(event, distance_km)] within `radius_km` of a point, nearest first.
+
+        When the bounding box spans more cells than the index has occupied,
+        every point is measured instead, so large radii cost O(events).
+        """
+        if not radius_km >= 0:  # Negative or NaN
+            return []
+        lat_cells = lon_cells = math.inf
+        if math.isfinite(radius_km):
+            lat_cells = math.ceil(radius_km / CELL_KM)
+            lon_cells = math.ceil(radius_km / (CELL_KM * max(math.cos(math.radians(lat)), 0.01)))
+        if (2 * lat_cells + 1) * (2 * lon_cells + 1) > len(self.grid):
+            candidates = np.arange(len(self.events))
+        else:
+            row, col = _cell(lat, lon)
+            candidates = np.array([
+                i
+                for r in range(row - lat_cells, row + lat_cells + 1)
+                for c in range(col - lon_cells, col + lon_cells + 1)
+                for i in self.grid.get((r, c), ())
+            ], dtype=int)
+        if not len(candidates):
+            return []
+        dist = haversine_matrix([lat], [lon], self.lats[candidates], self.lons[candidates])[0]
+        order = np.argsort(dist, kind="stable")
+        return [
+            (self.events[candidates[i]], float(dist[i])) for i in order if dist[i] <= radius_km
+        ]
+
+
+INDEX_CACHE_SIZE = 16
+_indexes = OrderedDict()  # event set id -> EventIndex
+_indexes_lock = threading.Lock()
+
+
+def events_index(set_id, events):
+    """Index over a stored event set, built once per set id and kept for the most recent sets."""
+    with _indexes_lock:
+        index = _indexes.get(set_id)
+        if index is not None:
+            _indexes.move_to_end(set_id)
+            return index
+    index = EventIndex()
+    index.add(events)
+    with _indexes_lock:
+        _indexes[set_id] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
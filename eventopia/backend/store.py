@@ -0,0 +1,163 @@
+"""Session-scoped storage for event sets, coordinates, itineraries and preferences.
+
+Every saved value gets its own record id and is kept in an in-process LRU in
+front of a SQLite table, so concurrent sessions never overwrite each other
+and a request can reference an earlier result by id without touching disk.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from metrics import count_cache, span
+
+STORE_PATH = os.getenv("SESSION_STORE_PATH", "json_output/sessions.db")
+RECORD_TTL = 7 * 24 * 3600
+LRU_SIZE = 256
+DEFAULT_SESSION = "default"
+
+# Files the frontend still reads directly; only the default session mirrors into them
+LEGACY_FILES = {
+    "events": "json_output/events_results.json",
+    "coordinates": "json_output/last_coordinates.json",
+    "itinerary": "json_output/final_itenary.json",
+    "preferences": "json_output/user_preference.json",
+}
+MIRROR_LEGACY_FILES = os.getenv("SESSION_LEGACY_FILES", "true").lower() == "true"
+
+
+def write_json_atomic(path, value):
+    """Writes JSON to a temporary file and renames it over `path`, so readers never see a partial file."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with span("file_write"):
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(value, file, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+
+class SessionStore:
+    """Records of a `kind` ("events", "coordinates", ...) per session, plus each session's latest one."""
+
+    def __init__(self, path=STORE_PATH, ttl=RECORD_TTL, lru_size=LRU_SIZE, mirror_legacy=MIRROR_LEGACY_FILES):
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.mirror_legacy = mirror_legacy
+        self._lru = OrderedDict()
+        self._latest = {}
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT PRIMARY KEY,
+                session TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS latest (
+                session TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (session, kind)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_created ON records (created_at)")
+        self._prune(time.time())
+        self._conn.commit()
+
+    def _remember(self, record_id, value):
+        self._lru[record_id] = value
+        self._lru.move_to_end(record_id)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def put(self, session, kind, value):
+        """Saves a value as the session's latest `kind` and returns its record id.
+
+        The record and the latest pointer are written in one transaction.
+        Stored values are shared with later readers and must not be mutated.
+        """
+        record_id = uuid.uuid4().hex
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock, span("store_write"):
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO records VALUES (?, ?, ?, ?, ?)",
+                    (record_id, session, kind, data, time.time()),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO latest VALUES (?, ?, ?)", (session, kind, record_id)
+                )
+            self._remember(record_id, value)
+            self._latest[(session, kind)] = record_id
+
+        if self.mirror_legacy and session == DEFAULT_SESSION and kind in LEGACY_FILES:
+            write_json_atomic(LEGACY_FILES[kind], value)
+        return record_id
+
+    def get(self, kind, record_id):
+        """Returns a stored value by record id, or None."""
+        with self._lock:
+            hit = record_id in self._lru
+            count_cache("session_store", hit)
+            if hit:
+                self._lru.move_to_end(record_id)
+                return self._lru[record_id]
+            with span("store_read"):
+                row = self._conn.execute(
+                    "SELECT data FROM records WHERE id = ? AND kind = ?", (record_id, kind)
+                ).fetchone()
+                if row is None:
+                    return None
+                value = json.loads(row[0])
+            self._remember(record_id, value)
+            return value
+
+    def latest_id(self, session, kind):
+        with self._lock:
+            if (session, kind) not in self._latest:
+                row = self._conn.execute(
+                    "SELECT id FROM latest WHERE session = ? AND kind = ?", (session, kind)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._latest[(session, kind)] = row[0]
+            return self._latest[(session, kind)]
+
+    def latest(self, session, kind):
+        """Returns (record id, value) of the session's most recent `kind`, or (None, None)."""
+        record_id = self.latest_id(session, kind)
+        if record_id is None:
+            return None, None
+        return record_id, self.get(kind, record_id)
+
+    def _prune(self, now):
+        self._conn.execute("DELETE FROM records WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute("DELETE FROM latest WHERE id NOT IN (SELECT id FROM records)")
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def session_store():
+    """Returns the process-wide session store, opening it on first use."""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = SessionStore()
+        return _shared_store
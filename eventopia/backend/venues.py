@@ -0,0 +1,149 @@
+"""Persistent venue registry keyed by Google Maps place id."""
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote
+
+REGISTRY_PATH = os.getenv("VENUE_REGISTRY_PATH", "json_output/venues.db")
+VENUE_TTL = float(os.getenv("VENUE_TTL", 30 * 24 * 3600))  # Venues move or close; re-geocode them now and then
+
+# Google Maps feature ids look like "!1s0x89ac...:0x1f5a..." in place/data links
+PLACE_ID_RE = re.compile(r"!1s(0x[0-9a-f]+:0x[0-9a-f]+)", re.IGNORECASE)
+
+
+def extract_place_id(event):
+    """Returns the Google Maps place id carried by a SerpAPI event, or None."""
+    location_map = event.get("event_location_map") or {}
+    for link in (location_map.get("link"), location_map.get("serpapi_link")):
+        if link:
+            match = PLACE_ID_RE.search(unquote(link))
+            if match:
+                return match.group(1).lower()
+    return None
+
+
+class VenueRegistry:
+    """Stores coordinates, rating and reviews once per venue, for at most `ttl` seconds."""
+
+    def __init__(self, path=REGISTRY_PATH, ttl=VENUE_TTL):
+        self.ttl = ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS venues (
+                place_id TEXT PRIMARY KEY,
+                name TEXT,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                rating REAL,
+                reviews INTEGER,
+                link TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, place_ids):
+        """Returns {place_id: venue dict} for the ids registered within the TTL."""
+        place_ids = list(set(place_ids))
+        if not place_ids:
+            return {}
+        placeholders = ",".join("?" * len(place_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT place_id, name, latitude, longitude, rating, reviews, link "
+                f"FROM venues WHERE place_id IN ({placeholders}) AND updated_at > ?",
+                place_ids + [time.time() - self.ttl],
+            ).fetchall()
+        columns = ("place_id", "name", "latitude", "longitude", "rating", "reviews", "link")
+        return {row[0]: dict(zip(columns, row)) for row in rows}
+
+    def upsert_many(self, records):
+        """Registers (place_id, venue block, lat, lon) tuples; newer coordinates and venue details win."""
+        now = time.time()
+        rows = [
+            (
+                place_id,
+                venue.get("name"),
+                lat,
+                lon,
+                venue.get("rating"),
+                venue.get("reviews"),
+                venue.get("link"),
+                now,
+            )
+            for place_id, venue, lat, lon in records
+        ]
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO venues VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(place_id) DO UPDATE SET
+                    latitude = excluded.latitude,
+                    longitude = excluded.longitude,
+                    name = COALESCE(excluded.name, name),
+                    rating = COALESCE(excluded.rating, rating),
+                    reviews = COALESCE(excluded.reviews, reviews),
+                    link = COALESCE(excluded.link, link),
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+            self._conn.commit()
+
+
+_shared_registry = None
+_shared_lock = threading.Lock()
+
+
+def venue_registry():
+    """Returns the process-wide registry, opening it on first use."""
+    global _shared_registry
+    with _shared_lock:
+        if _shared_registry is None:
+            _shared_registry = VenueRegistry()
+        return _shared_registry
+
+
+def apply_venues(events):
+    """Fills coordinates (and missing venue details) from the registry.
+
+    Returns the number of events resolved without geocoding.
+    """
+    ids = {id(event): extract_place_id(event) for event in events}
+    known = venue_registry().get_many(pid for pid in ids.values() if pid)
+
+    resolved = 0
+    for event in events:
+        venue = known.get(ids[id(event)])
+        if venue is None or event.get("latitude") is not None:
+            continue
+        event["latitude"] = venue["latitude"]
+        event["longitude"] = venue["longitude"]
+        block = event.setdefault("venue", {})
+        for field in ("name", "rating", "reviews", "link"):
+            if block.get(field) is None and venue[field] is not None:
+                block[field] = venue[field]
+        resolved += 1
+    return resolved
+
+
+def register_venues(events):
+    """Records the coordinates of geocoded events that carry a place id.
+
+    Only pass events located at the venue itself; a city-level fallback
+    would otherwise stand in for the venue until the row expires.
+    """
+    records = []
+    for event in events:
+        place_id = extract_place_id(event)
+        if place_id and event.get("latitude") is not None and event.get("longitude") is not None:
+            records.append((place_id, event.get("venue") or {}, event["latitude"], event["longitude"]))
+    if records:
+        venue_registry().upsert_many(records)
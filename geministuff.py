@@ -1,24 +1,20 @@
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
-import geocoder
 import json
-import sqlite3
-import shutil
-import pandas as pd
-from datetime import datetime, timedelta
-import re
+import sys
+
+# Share the backend's prompt projection with this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "eventopia", "backend"))
+from projection import project_events, project_history, report_savings, compact_json
+from llm import gemini_model, generate_json, LLMOutputError, ITINERARY_SCHEMA, PREFERENCES_SCHEMA
+from client_location import resolve_client_location, location_latlng
+from browsing_history import chrome_history_path, open_history, chrome_time
 
 # Load environment variables
 load_dotenv()
-api_key = os.environ["API_KEY"]
-genai.configure(api_key=api_key)
 
-# Initialize Gemini Model
-gemini_client = genai.GenerativeModel(
-    model_name="gemini-1.5-flash",
-    system_instruction="You are a local travel planner who will create an itinerary based on a list of events that are happening around and your own knowledge of things to do.",
-)
+# Gemini clients are built on first use through the backend's shared registry
+PLANNER_INSTRUCTION = "You are a local travel planner who will create an itinerary based on a list of events that are happening around and your own knowledge of things to do."
 
 #######################################################################################################################
 
@@ -31,14 +27,14 @@ def generate_itenary(
     cost,
     use_feature,
     mode_of_transport,
-    model=gemini_client,
+    model=None,
 ):
     """Generates a travel itinerary using Gemini AI based on available events and user preferences."""
+    model = model or gemini_model("gemini-1.5-flash", PLANNER_INSTRUCTION)
 
     # Fetch user's current location
     if current_location == "current":
-        g = geocoder.ip("me")
-        current_location = g.latlng if g.latlng else "Unknown Location"
+        current_location = location_latlng(resolve_client_location(None)) or "Unknown Location"
 
     # Load event data
     events_file = "json_output/events_results.json"
@@ -57,6 +53,9 @@ def generate_itenary(
     else:
         feature_text = ""
 
+    # Only the fields the planner needs go into the prompt
+    event_rows = project_events(events, label="itinerary")
+
     # Construct the query for Gemini
     query = f"""
     You are a structured travel planner. Create an itinerary based on the given events.
@@ -88,7 +87,7 @@ def generate_itenary(
         "total_estimated_time": 24
     }}
 
-    In addition to the events we upload, include your knowledge of restaurant and public spaces if needed in your output. The events are: {json.dumps(events)}.
+    In addition to the events we upload, include your knowledge of restaurant and public spaces if needed in your output. The events are: {compact_json(event_rows)}.
     "Generate most of the itenary from events which wasy uploaded in the file above."
     
 
@@ -108,19 +107,11 @@ def generate_itenary(
     Ensure the response is **strictly valid JSON**, without Markdown, explanations, or extra text.
     """
 
-    response = model.generate_content(query)
-    itenary = response.text  # Get raw Gemini response
-
-    # Remove Markdown formatting if present
-    itenary = re.sub(r"```(geojson|json)\n", "", itenary)
-    itenary = re.sub(r"\n```", "", itenary)
-
-    # Convert JSON string to Python dictionary
     try:
-        parsed_itenary = json.loads(itenary)
-    except json.JSONDecodeError:
-        print("ERROR: Gemini returned invalid JSON. Saving raw response instead.")
-        parsed_itenary = itenary  # Save as raw text if JSON parsing fails
+        parsed_itenary = generate_json(model, query, "itinerary", ITINERARY_SCHEMA)
+    except LLMOutputError as e:
+        print(f"ERROR: Gemini did not return a valid itinerary: {e}")
+        return {}
 
     # Save cleaned JSON
     output_file = "json_output/final_itenary.json"
@@ -133,50 +124,34 @@ def generate_itenary(
 
 def user_browser_history():
     """Fetches browsing history from Google Chrome and saves it as a JSON file."""
-    if os.name == "nt":  # Windows
-        history_db_path = os.path.expanduser(
-            r"~\AppData\Local\Google\Chrome\User Data\Default\History"
-        )
-    elif os.name == "posix":  # Mac/Linux
-        history_db_path = os.path.expanduser(
-            "~/Library/Application Support/Google/Chrome/Default/History"
-        )
-
-    # Create a temporary copy of the history database
-    temp_db_path = "./chrome_history_temp.db"
-    shutil.copy2(history_db_path, temp_db_path)
-
-    # Connect to the copied database
-    conn = sqlite3.connect(temp_db_path)
-    cursor = conn.cursor()
-
-    # Query to fetch browsing history
-    query = """
-    SELECT url, title, visit_count, last_visit_time 
-    FROM urls
-    ORDER BY last_visit_time DESC
-    LIMIT 100;
-    """
-
-    cursor.execute(query)
-    history_data = cursor.fetchall()
-
-    # Convert Chrome's timestamp format to human-readable datetime
-    def convert_chrome_timestamp(timestamp):
-        return datetime(1601, 1, 1) + timedelta(microseconds=timestamp)
-
-    df = pd.DataFrame(history_data, columns=["URL", "Title", "Visit Count", "Last Visit Time"])
-    df["Last Visit Time"] = df["Last Visit Time"].apply(convert_chrome_timestamp)
-
-    conn.close()
+    # Read Chrome's database in place, read-only (no temporary copy)
+    conn = open_history(chrome_history_path())
+    try:
+        history_data = conn.execute(
+            """
+            SELECT url, title, visit_count, last_visit_time
+            FROM urls
+            ORDER BY last_visit_time DESC
+            LIMIT 100;
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+
+    history = [
+        {"URL": url, "Title": title, "Visit Count": visits, "Last Visit Time": chrome_time(last_visit)}
+        for url, title, visits, last_visit in history_data
+    ]
 
     # Save history to JSON
-    df.to_json("json_output/chrome_browsing_history.json", orient="records", indent=4)
+    with open("json_output/chrome_browsing_history.json", "w", encoding="utf-8") as json_file:
+        json.dump(history, json_file, indent=4, ensure_ascii=False)
 
 #######################################################################################################################
 
-def user_features_browsing_history(model=genai.GenerativeModel("gemini-2.0-flash")):
+def user_features_browsing_history(model=None):
     """Generates user preferences based on browsing history using Gemini AI."""
+    model = model or gemini_model("gemini-2.0-flash")
     history_file = "json_output/chrome_browsing_history.json"
 
     # Load browsing history
@@ -187,22 +162,22 @@ def user_features_browsing_history(model=genai.GenerativeModel("gemini-2.0-flash
         print("ERROR: Browsing history file not found.")
         return {}
 
+    history_rows = [project_history(row) for row in history]
+    report_savings("browsing history", history, history_rows)
+
     query = f"""
     Analyze this user's browsing history and identify themes of interest.
-    Return the response strictly as a JSON object without explanations.
+    Give each theme a weight between 0 and 1 and a few keywords.
 
     Browsing History:
-    {json.dumps(history, indent=4)}
+    {compact_json(history_rows)}
     """
 
-    response = model.generate_content(query)
-    profile_features = response.text
-
     try:
-        parsed_features = json.loads(profile_features)
-    except json.JSONDecodeError:
-        print("ERROR: Gemini returned invalid JSON. Saving raw response instead.")
-        parsed_features = profile_features  # Save as raw text if JSON parsing fails
+        parsed_features = generate_json(model, query, "user_history", PREFERENCES_SCHEMA)
+    except LLMOutputError as e:
+        print(f"ERROR: Gemini did not return a valid preference profile: {e}")
+        return {}
 
     output_file = "json_output/user_preference.json"
     with open(output_file, "w", encoding="utf-8") as json_file: